@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+# La configuracion se fija antes de importar la app: db.client y utils.auth leen el entorno al importarse
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB", "ptbackend_bench")
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_DURATION", "60")
+os.environ.setdefault("DASH_CACHE_SIZE", "0")
+# Un mongod local standalone no soporta transacciones
+os.environ.setdefault("MONGO_TRANSACTIONS", "false")
+
+import httpx
+from passlib.context import CryptContext
+
+from db.client import db_client
+from db.durations import backfill_completion_hours
+from db.indexes import ensure_indexes
+from db.rollups import rebuild_rollups
+from main import app
+
+ADMIN_USERNAME = "BENCH"
+ADMIN_PASSWORD = "bench-password"
+AIRLINES = ["Avianca", "Copa", "LATAM", "American", "Iberia", "Delta"]
+ZONES = ["Norte", "Sur", "Este", "Oeste"]
+DESTINATIONS = ["BOG", "MDE", "CLO", "CTG", "PTY", "MIA", "MAD"]
+STATUSES = ["Pendiente", "Activo", "Finalizado", "Facturado"]
+OPERATORS = 200
+SEED_BATCH = 10_000
+# seed() borra users y reports: sin --yes-wipe solo se acepta una base *_bench
+BENCH_DB_SUFFIX = "_bench"
+
+# (nombre, metodo, ruta, parametros, peticiones relativas)
+SCENARIOS = [
+    ("login", "POST", "/users/login", None, 0.1),
+    ("users_me", "GET", "/users/me", None, 1),
+    ("get_reports_page", "GET", "/reports/", {"limit": 100}, 1),
+    ("dash_monthly", "GET", "/dash/", {"filter": "monthly"}, 1),
+    ("dash_year", "GET", "/dash/", {"filter": "year"}, 1),
+    ("dash_all_years", "GET", "/dash/", {"filter": "all years"}, 1),
+    ("dash_weekly_hourly", "GET", "/dash/", {"filter": "weekly", "granularity": "hour"}, 1),
+    ("dash_status_percentages", "GET", "/dash/status-percentages", None, 1),
+    ("dash_completion_times", "GET", "/dash/average-completion-times", {"delivery_zone": "Norte"}, 1),
+    ("dash_completion_matrix", "GET", "/dash/average-completion-times", None, 1),
+    ("dash_overview", "GET", "/dash/overview", {"filter": "monthly"}, 1),
+]
+
+
+def bench_target() -> str:
+    # Hosts y base de datos, sin las credenciales de la URI
+    hosts = db_client.settings.uri.split("://", 1)[-1].rsplit("@", 1)[-1].split("/", 1)[0]
+    return f"{hosts}/{db_client.settings.database}"
+
+
+async def seed(reports: int, rng: random.Random):
+    # Datos sinteticos reproducibles: un admin, operadores y reportes repartidos en dos años
+    await db_client.users.delete_many({})
+    await db_client.reports.delete_many({})
+
+    crypt = CryptContext(schemes=["bcrypt"])
+    await db_client.users.insert_one(
+        {
+            "username": ADMIN_USERNAME,
+            "full_name": "Bench Admin",
+            "first_name": "Bench",
+            "last_name": "Admin",
+            "disabled": False,
+            "role": "Admin",
+            "zone": ZONES[0],
+            "password": crypt.hash(ADMIN_PASSWORD),
+        }
+    )
+
+    now = datetime.now()
+    for start in range(0, reports, SEED_BATCH):
+        batch = []
+        for _ in range(min(SEED_BATCH, reports - start)):
+            creation_date = now - timedelta(minutes=rng.randrange(60 * 24 * 730))
+            delivery_status = rng.choice(STATUSES)
+            operator_id = rng.randrange(OPERATORS)
+            report = {
+                "creation_date": creation_date,
+                "airline": rng.choice(AIRLINES),
+                "reference_number": rng.randrange(10**6),
+                "bdo_number": rng.randrange(10**6),
+                "delivery_zone": rng.choice(ZONES),
+                "destination": rng.choice(DESTINATIONS),
+                "operator": {"operator_id": f"op{operator_id}", "operator_name": f"Operador {operator_id}"},
+                "delivery_status": delivery_status,
+            }
+            if delivery_status in ("Finalizado", "Facturado"):
+                report["delivery_date"] = creation_date + timedelta(minutes=rng.randrange(30, 60 * 72))
+            batch.append(report)
+        await db_client.reports.insert_many(batch, ordered=False)
+
+    await backfill_completion_hours()
+    await ensure_indexes()
+    await rebuild_rollups()
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    if len(latencies) == 1:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run_scenario(client: httpx.AsyncClient, token: str, scenario, requests: int, concurrency: int) -> dict:
+    name, method, path, params, weight = scenario
+    total = max(1, int(requests * weight))
+    latencies = []
+    statuses = {}
+    pending = iter(range(total))
+
+    async def worker():
+        for _ in pending:
+            started = time.perf_counter()
+            if name == "login":
+                response = await client.post(
+                    path, data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD}
+                )
+            else:
+                response = await client.request(
+                    method, path, params=params, headers={"Authorization": f"Bearer {token}"}
+                )
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def run_volume(reports: int, args) -> dict:
+    rng = random.Random(args.seed)
+    existing = await db_client.reports.estimated_document_count()
+    if args.reseed or existing != reports:
+        print(f"Seeding {reports} reports into {bench_target()} (users and reports are deleted)...")
+        await seed(reports, rng)
+
+    results = {}
+    # ASGITransport no ejecuta el lifespan: se abre a mano para que la app arranque igual que en uvicorn
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            login = await client.post(
+                "/users/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD}
+            )
+            login.raise_for_status()
+            token = login.json()["token"]
+
+            for scenario in SCENARIOS:
+                if args.only and scenario[0] not in args.only:
+                    continue
+                results[scenario[0]] = await run_scenario(
+                    client, token, scenario, args.requests, args.concurrency
+                )
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    # Regresion: p95 mas lento o rps mas bajo que la linea base por encima del umbral
+    regressions = []
+    for volume, scenarios in results.items():
+        for name, metrics in scenarios.items():
+            base = baseline.get(volume, {}).get(name)
+            if base is None:
+                continue
+            if metrics["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append(f"{volume}/{name}: p95 {base['p95_ms']} -> {metrics['p95_ms']} ms")
+            if metrics["rps"] < base["rps"] * (1 - threshold):
+                regressions.append(f"{volume}/{name}: rps {base['rps']} -> {metrics['rps']}")
+    return regressions
+
+
+def print_results(volume: str, scenarios: dict):
+    print(f"\n{volume} reports")
+    print(f"{'endpoint':<26}{'reqs':>7}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for name, metrics in scenarios.items():
+        print(
+            f"{name:<26}{metrics['requests']:>7}{metrics['rps']:>10}{metrics['p50_ms']:>10}"
+            f"{metrics['p95_ms']:>10}{metrics['p99_ms']:>10}  {metrics['statuses']}"
+        )
+
+
+async def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Endpoint benchmarks against a local MongoDB")
+    parser.add_argument("--volumes", default="10000", help="Comma separated report counts, e.g. 10000,100000,1000000")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data")
+    parser.add_argument("--reseed", action="store_true", help="Reseed even if the database already has the volume")
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json", help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument(
+        "--yes-wipe",
+        action="store_true",
+        help=f"Allow seeding a database whose name does not end in {BENCH_DB_SUFFIX}",
+    )
+    args = parser.parse_args(argv)
+
+    print(f"Benchmark database: {bench_target()}")
+    if not (db_client.settings.database or "").endswith(BENCH_DB_SUFFIX) and not args.yes_wipe:
+        print(
+            f"Refusing to run: the database name does not end in {BENCH_DB_SUFFIX} and seeding "
+            "deletes every user and report. Pass --yes-wipe to run against it anyway.",
+            file=sys.stderr,
+        )
+        return 2
+
+    results = {}
+    for volume in args.volumes.split(","):
+        results[volume] = await run_volume(int(volume), args)
+        print_results(volume, results[volume])
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
+
+from db.client import db_client
+from db.versions import bump_versions, report_version_keys
+from models.report import DeliveryStatus
+
+load_dotenv()
+
+# Los reportes Facturado (estado final) con delivery_date mas vieja que
+# ARCHIVE_AFTER_DAYS se mueven de reports a reports_archive. Los rollups siguen
+# contando los reportes archivados; las lecturas por rango de fechas agregan el
+# archivo solo si el rango empieza antes del horizonte de archivo.
+ARCHIVE_COLLECTION = "reports_archive"
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+DUPLICATE_KEY = 11000
+
+
+def archive_horizon() -> datetime:
+    # Todo lo archivado tiene creation_date <= delivery_date < horizonte
+    return datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def range_needs_archive(match_conditions: dict, date_field: str) -> bool:
+    condition = match_conditions.get(date_field)
+    start = condition.get("$gte") if isinstance(condition, dict) else None
+    return start is None or start < archive_horizon()
+
+
+def report_collections(db, match_conditions: dict, date_field: str) -> list:
+    collections = [db.reports]
+    if range_needs_archive(match_conditions, date_field):
+        collections.append(db[ARCHIVE_COLLECTION])
+    return collections
+
+
+def union_archive(match: dict) -> dict:
+    # Para agregaciones sobre reports: suma los archivados que cumplen el mismo $match
+    return {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": [{"$match": match}]}}
+
+
+async def archive_reports(db=db_client, cutoff: datetime | None = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    cutoff = cutoff or archive_horizon()
+    query = {"delivery_status": DeliveryStatus.invoiced.value, "delivery_date": {"$lt": cutoff}}
+    moved = 0
+
+    while True:
+        batch = await db.reports.find(query).sort("_id", 1).limit(batch_size).to_list()
+        if not batch:
+            return moved
+
+        # Primero se copia y despues se borra: si el proceso se corta entre los
+        # dos pasos, la siguiente corrida ignora los duplicados y termina el borrado
+        try:
+            await db[ARCHIVE_COLLECTION].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+
+        result = await db.reports.delete_many(
+            {"_id": {"$in": [report["_id"] for report in batch]}, **query}
+        )
+        if result.deleted_count == 0:
+            return moved
+        moved += result.deleted_count
+        # Los listados de /reports/ de esas zonas cambiaron
+        await bump_versions(report_version_keys(report.get("delivery_zone") for report in batch), db)
+
+
+if __name__ == "__main__":
+    # python -m db.archive
+    moved = asyncio.run(archive_reports())
+    print(f"Archived {moved} reports")
@@ -1,8 +1,13 @@
-from pymongo import MongoClient
+from dataclasses import dataclass
+from pymongo import AsyncMongoClient
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 from dotenv import load_dotenv
 import os
+import time
 
-load_dotenv() 
+from utils.metrics import MongoCommandListener, MongoPoolListener
+
+load_dotenv()
 
 MONGO_USER = os.getenv('MONGO_USER')
 MONGO_PASSWORD = os.getenv('MONGO_PASSWORD')
@@ -10,7 +15,157 @@ MONGO_HOST = os.getenv('MONGO_HOST')
 MONGO_DB = os.getenv('MONGO_DB')
 
 
-uri_db = f"mongodb+srv://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}"
+def _optional_int(name: str) -> int | None:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+@dataclass(frozen=True)
+class MongoSettings:
+    # MONGO_URI permite apuntar a un mongod local (por ejemplo en los benchmarks)
+    uri: str = os.getenv('MONGO_URI') or f"mongodb+srv://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}"
+    database: str = MONGO_DB
+    max_pool_size: int = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    min_pool_size: int = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+    max_idle_time_ms: int | None = _optional_int('MONGO_MAX_IDLE_TIME_MS')
+    server_selection_timeout_ms: int = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000'))
+    connect_timeout_ms: int = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '20000'))
+    socket_timeout_ms: int | None = _optional_int('MONGO_SOCKET_TIMEOUT_MS')
+    # Lista separada por comas, por ejemplo "zstd,snappy,zlib" (zstd y snappy necesitan sus paquetes)
+    compressors: str = os.getenv('MONGO_COMPRESSORS', '')
+    retry_writes: bool = os.getenv('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+    retry_reads: bool = os.getenv('MONGO_RETRY_READS', 'true').lower() == 'true'
+    # Hace un ping al arrancar para que la primera peticion no pague la conexion
+    warm_up: bool = os.getenv('MONGO_WARM_UP', 'false').lower() == 'true'
+    # Escrituras de reportes y rollups en una transaccion (requiere replica set,
+    # como Atlas); false solo para un mongod standalone de desarrollo
+    transactions: bool = os.getenv('MONGO_TRANSACTIONS', 'true').lower() == 'true'
+    # Lecturas del dashboard y exportaciones; el resto va al primario.
+    # max staleness en segundos (minimo 90 segun el driver, -1 sin limite)
+    analytics_read_preference: str = os.getenv('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+    analytics_max_staleness: int = int(os.getenv('MONGO_ANALYTICS_MAX_STALENESS', '90'))
+
+    def client_options(self) -> dict:
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "retryWrites": self.retry_writes,
+            "retryReads": self.retry_reads,
+        }
+        if self.max_idle_time_ms is not None:
+            options["maxIdleTimeMS"] = self.max_idle_time_ms
+        if self.compressors:
+            options["compressors"] = self.compressors
+        return options
+
+    def analytics_read_preferences(self):
+        modes = {
+            "primaryPreferred": PrimaryPreferred,
+            "secondary": Secondary,
+            "secondaryPreferred": SecondaryPreferred,
+            "nearest": Nearest,
+        }
+        if self.analytics_read_preference == "primary":
+            return Primary()
+        return modes[self.analytics_read_preference](max_staleness=self.analytics_max_staleness)
+
+    def analytics_lag_seconds(self) -> float:
+        # Cuanto puede atrasarse una lectura de analytics_db respecto del primario
+        if self.analytics_read_preference == "primary":
+            return 0
+        if self.analytics_max_staleness < 0:
+            return float("inf")
+        return self.analytics_max_staleness
+
+
+class LazyDatabase:
+    # El cliente se crea en el primer uso (o en el lifespan de main.py), no al
+    # importar: con mongodb+srv crearlo resuelve DNS y frena el arranque en frio.
+    # Los modulos siguen importando db_client y lo usan como una base de datos.
+    def __init__(self, settings: MongoSettings):
+        self.settings = settings
+        self.client = None
+        self.pool_listener = MongoPoolListener()
+        self.connect_seconds = None
+        self.warm_up_seconds = None
+        self._database = None
+
+    def connect(self):
+        if self._database is None:
+            started = time.perf_counter()
+            self.client = AsyncMongoClient(
+                self.settings.uri,
+                event_listeners=[MongoCommandListener(), self.pool_listener],
+                **self.settings.client_options(),
+            )
+            self._database = self.client[self.settings.database]
+            self.connect_seconds = time.perf_counter() - started
+        return self._database
+
+    async def warm_up(self):
+        started = time.perf_counter()
+        await self.connect().command("ping")
+        self.warm_up_seconds = time.perf_counter() - started
+
+    async def transaction(self, callback):
+        # callback(session) hace las escrituras; with_transaction reintenta los
+        # errores transitorios y confirma. Sin transacciones se ejecuta sin sesion.
+        if not self.settings.transactions:
+            return await callback(None)
+        self.connect()
+        async with self.client.start_session() as session:
+            return await session.with_transaction(callback)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+        self.client = None
+        self._database = None
+
+    def pool_state(self) -> dict:
+        return {
+            "connected": self.client is not None,
+            "max_pool_size": self.settings.max_pool_size,
+            "min_pool_size": self.settings.min_pool_size,
+            "connect_seconds": self.connect_seconds,
+            "warm_up_seconds": self.warm_up_seconds,
+            "servers": self.pool_listener.stats(),
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+    def __getitem__(self, name):
+        return self.connect()[name]
+
+
+class RoutedDatabase:
+    # La misma base de datos (y el mismo pool) con otra preferencia de lectura
+    def __init__(self, database: LazyDatabase, read_preference):
+        self.database = database
+        self.read_preference = read_preference
+        self._source = None
+        self._routed = None
+
+    def connect(self):
+        source = self.database.connect()
+        if self._source is not source:
+            self._source = source
+            self._routed = source.with_options(read_preference=self.read_preference)
+        return self._routed
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+    def __getitem__(self, name):
+        return self.connect()[name]
+
 
-db_conection = MongoClient(uri_db)
-db_client = db_conection[MONGO_DB]
+mongo_settings = MongoSettings()
+# Escrituras, autenticacion y lecturas que deben ver la ultima escritura
+db_client = LazyDatabase(mongo_settings)
+# Agregaciones del dashboard y exportaciones: pueden leer de un secundario
+analytics_db = RoutedDatabase(db_client, mongo_settings.analytics_read_preferences())
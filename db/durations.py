@@ -0,0 +1,40 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+from db.archive import ARCHIVE_COLLECTION
+from db.client import db_client
+
+# Horas entre creation_date y delivery_date. Se guarda en el reporte al pasar a
+# Finalizado para que /dash/average-completion-times no lo recalcule en cada consulta.
+COMPLETION_FIELD = "completion_hours"
+MILLISECONDS_PER_HOUR = 1000 * 60 * 60
+
+
+def completion_hours(creation_date: datetime, delivery_date: datetime) -> float:
+    # Misma cuenta que completion_hours_expression: milisegundos enteros / hora
+    return (delivery_date - creation_date) // timedelta(milliseconds=1) / MILLISECONDS_PER_HOUR
+
+
+def completion_hours_expression(delivery_date) -> dict:
+    # Para updates con pipeline: calcula el campo con el creation_date guardado
+    return {"$divide": [{"$subtract": [delivery_date, "$creation_date"]}, MILLISECONDS_PER_HOUR]}
+
+
+async def backfill_completion_hours(db=db_client) -> int:
+    modified = 0
+    for collection_name in ("reports", ARCHIVE_COLLECTION):
+        result = await db[collection_name].update_many(
+            {"delivery_date": {"$ne": None}, COMPLETION_FIELD: {"$exists": False}},
+            [{"$set": {COMPLETION_FIELD: completion_hours_expression("$delivery_date")}}],
+        )
+        modified += result.modified_count
+    return modified
+
+
+if __name__ == "__main__":
+    # python -m db.durations --backfill
+    if "--backfill" not in sys.argv[1:]:
+        print("Usage: python -m db.durations --backfill")
+        sys.exit(1)
+    print(f"Updated {asyncio.run(backfill_completion_hours())} reports")
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import sys
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from db.archive import ARCHIVE_COLLECTION
+from db.client import db_client
+from db.durations import COMPLETION_FIELD
+from db.rollups import ROLLUP_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Indices declarados por coleccion. Las claves siguen el orden igualdad -> rango
+# de los $match de routers/reports.py y routers/dash.py.
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "reports": [
+        # get_reports de operadores y supervisores, paginado por _id
+        IndexModel([("delivery_zone", ASCENDING), ("_id", ASCENDING)], name="zone_id"),
+        # /dash/ por estado y ventana de fechas
+        IndexModel(
+            [("delivery_status", ASCENDING), ("delivery_date", ASCENDING)],
+            name="status_delivery_date",
+        ),
+        IndexModel(
+            [("delivery_status", ASCENDING), ("creation_date", ASCENDING)],
+            name="status_creation_date",
+        ),
+        # /dash/ y /dash/status-percentages filtrados por operador
+        IndexModel(
+            [
+                ("operator.operator_id", ASCENDING),
+                ("delivery_status", ASCENDING),
+                ("delivery_date", ASCENDING),
+            ],
+            name="operator_status_delivery_date",
+        ),
+        # /dash/ filtrado por aerolinea
+        IndexModel(
+            [
+                ("airline", ASCENDING),
+                ("delivery_status", ASCENDING),
+                ("delivery_date", ASCENDING),
+            ],
+            name="airline_status_delivery_date",
+        ),
+        # /dash/average-completion-times: solo reportes con duracion guardada,
+        # la agregacion por zona x destino se resuelve desde el indice
+        IndexModel(
+            [
+                ("delivery_zone", ASCENDING),
+                ("destination", ASCENDING),
+                (COMPLETION_FIELD, ASCENDING),
+            ],
+            name="zone_destination_completion",
+            partialFilterExpression={COMPLETION_FIELD: {"$exists": True}},
+        ),
+    ],
+    # Lecturas por rango de fechas que llegan antes del horizonte de archivo
+    ARCHIVE_COLLECTION: [
+        IndexModel(
+            [("delivery_status", ASCENDING), ("delivery_date", ASCENDING)],
+            name="status_delivery_date",
+        ),
+        IndexModel(
+            [("delivery_status", ASCENDING), ("creation_date", ASCENDING)],
+            name="status_creation_date",
+        ),
+        IndexModel(
+            [
+                ("delivery_zone", ASCENDING),
+                ("destination", ASCENDING),
+                (COMPLETION_FIELD, ASCENDING),
+            ],
+            name="zone_destination_completion",
+            partialFilterExpression={COMPLETION_FIELD: {"$exists": True}},
+        ),
+    ],
+    ROLLUP_COLLECTION: [
+        # Un documento por bucket: las escrituras hacen upsert sobre esta clave
+        IndexModel(
+            [
+                ("date_field", ASCENDING),
+                ("delivery_status", ASCENDING),
+                ("day", ASCENDING),
+                ("airline", ASCENDING),
+                ("operator_id", ASCENDING),
+                ("delivery_zone", ASCENDING),
+            ],
+            name="bucket_unique",
+            unique=True,
+        ),
+        IndexModel(
+            [("operator_id", ASCENDING), ("date_field", ASCENDING), ("day", ASCENDING)],
+            name="operator_day",
+        ),
+    ],
+}
+
+
+async def ensure_indexes(db=db_client):
+    # create_indexes no hace nada si el indice ya existe con la misma definicion
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection_name, e)
+
+
+async def index_report(db=db_client) -> dict:
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        declared = {index.document["name"] for index in indexes}
+        existing = set(await collection.index_information())
+
+        stats = await (await collection.aggregate([{"$indexStats": {}}])).to_list()
+        unused = sorted(
+            stat["name"]
+            for stat in stats
+            if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0
+        )
+
+        report[collection_name] = {
+            "missing": sorted(declared - existing),
+            "undeclared": sorted(existing - declared - {"_id_"}),
+            "unused": unused,
+        }
+    return report
+
+
+async def main(argv: list[str]):
+    # python -m db.indexes          crea los indices que falten y muestra el reporte
+    # python -m db.indexes --check  solo muestra el reporte
+    if "--check" not in argv:
+        await ensure_indexes()
+
+    report = await index_report()
+    for collection_name, result in report.items():
+        print(f"{collection_name}:")
+        for key in ("missing", "undeclared", "unused"):
+            print(f"  {key}: {', '.join(result[key]) or '-'}")
+
+    return 1 if any(result["missing"] for result in report.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,151 @@
+import asyncio
+import sys
+from collections import Counter
+from datetime import datetime
+from pymongo import UpdateOne
+
+from db.archive import ARCHIVE_COLLECTION
+from db.client import db_client
+
+# Conteos de reportes pre-agregados por dia x aerolinea x estado x operador x zona.
+# Cada reporte cuenta en el dia de creation_date y, si ya tiene delivery_date,
+# tambien en el dia de delivery_date (date_field indica cual de los dos).
+ROLLUP_COLLECTION = "report_rollups"
+DATE_FIELDS = ("creation_date", "delivery_date")
+
+
+def day_start(date: datetime) -> datetime:
+    return datetime(date.year, date.month, date.day)
+
+
+def rollup_keys(report: dict) -> list[tuple]:
+    operator = report.get("operator") or {}
+    delivery_status = report.get("delivery_status")
+    # DeliveryStatus y su valor en texto deben caer en el mismo bucket
+    delivery_status = getattr(delivery_status, "value", delivery_status)
+    keys = []
+    for date_field in DATE_FIELDS:
+        date = report.get(date_field)
+        if date is None:
+            continue
+        keys.append(
+            (
+                date_field,
+                day_start(date),
+                report.get("airline"),
+                delivery_status,
+                operator.get("operator_id"),
+                report.get("delivery_zone"),
+            )
+        )
+    return keys
+
+
+def rollup_filter(key: tuple) -> dict:
+    date_field, day, airline, delivery_status, operator_id, delivery_zone = key
+    return {
+        "date_field": date_field,
+        "day": day,
+        "airline": airline,
+        "delivery_status": delivery_status,
+        "operator_id": operator_id,
+        "delivery_zone": delivery_zone,
+    }
+
+
+def rollup_deltas(changes: list[tuple[dict | None, dict | None]]) -> dict[tuple, int]:
+    # Resta los buckets de cada documento anterior y suma los del nuevo
+    deltas = Counter()
+    for before, after in changes:
+        if before is not None:
+            deltas.subtract(rollup_keys(before))
+        if after is not None:
+            deltas.update(rollup_keys(after))
+    return {key: delta for key, delta in deltas.items() if delta != 0}
+
+
+async def apply_report_change(
+    before: dict | None, after: dict | None, db=db_client, session=None
+) -> dict[tuple, int]:
+    return await apply_report_changes([(before, after)], db, session)
+
+
+async def apply_report_changes(
+    changes: list[tuple[dict | None, dict | None]], db=db_client, session=None
+) -> dict[tuple, int]:
+    # Con session se aplica en la misma transaccion que la escritura del reporte
+    # Todos los buckets afectados se actualizan en un solo bulk_write
+    deltas = rollup_deltas(changes)
+    operations = [
+        UpdateOne(rollup_filter(key), {"$inc": {"count": delta}}, upsert=True)
+        for key, delta in deltas.items()
+    ]
+    if operations:
+        await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False, session=session)
+    return deltas
+
+
+def rollup_match(match_conditions: dict, date_field: str) -> dict:
+    # Traduce un $match sobre reports al equivalente sobre los rollups
+    match = {"date_field": date_field}
+    for field, condition in match_conditions.items():
+        if field == "operator.operator_id":
+            match["operator_id"] = condition
+        elif field in DATE_FIELDS:
+            match["day"] = {
+                operator: day_start(value) for operator, value in condition.items()
+            }
+        else:
+            match[field] = condition
+    return match
+
+
+def _bucket_pipeline(date_field: str) -> list[dict]:
+    return [
+        {"$match": {date_field: {"$type": "date"}}},
+        {
+            "$project": {
+                "date_field": {"$literal": date_field},
+                "day": {"$dateTrunc": {"date": f"${date_field}", "unit": "day"}},
+                "airline": {"$ifNull": ["$airline", None]},
+                "delivery_status": {"$ifNull": ["$delivery_status", None]},
+                "operator_id": {"$ifNull": ["$operator.operator_id", None]},
+                "delivery_zone": {"$ifNull": ["$delivery_zone", None]},
+            }
+        },
+    ]
+
+
+async def rebuild_rollups(db=db_client):
+    # Recalcula todos los buckets desde reports y reports_archive. $out reemplaza
+    # la coleccion de forma atomica y conserva sus indices.
+    pipeline = [
+        *_bucket_pipeline("creation_date"),
+        {"$unionWith": {"coll": "reports", "pipeline": _bucket_pipeline("delivery_date")}},
+        {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": _bucket_pipeline("creation_date")}},
+        {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": _bucket_pipeline("delivery_date")}},
+        {
+            "$group": {
+                "_id": {
+                    "date_field": "$date_field",
+                    "day": "$day",
+                    "airline": "$airline",
+                    "delivery_status": "$delivery_status",
+                    "operator_id": "$operator_id",
+                    "delivery_zone": "$delivery_zone",
+                },
+                "count": {"$sum": 1},
+            }
+        },
+        {"$replaceWith": {"$mergeObjects": ["$_id", {"count": "$count"}]}},
+        {"$out": ROLLUP_COLLECTION},
+    ]
+    await (await db.reports.aggregate(pipeline)).to_list()
+
+
+if __name__ == "__main__":
+    # python -m db.rollups --rebuild
+    if "--rebuild" not in sys.argv[1:]:
+        print("Usage: python -m db.rollups --rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild_rollups())
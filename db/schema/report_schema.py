@@ -1,4 +1,17 @@
-from models.report import BdoOrder
+from models.report import BdoOrder, DeliveryStatus, Operator
+
+# Solo los campos que usa report_Schema
+REPORT_PROJECTION = {
+    "creation_date": 1,
+    "delivery_date": 1,
+    "airline": 1,
+    "reference_number": 1,
+    "bdo_number": 1,
+    "destination": 1,
+    "delivery_zone": 1,
+    "operator": 1,
+    "delivery_status": 1,
+}
 
 def report_Schema(report: BdoOrder) -> dict:
     return {
@@ -12,4 +25,13 @@ def report_Schema(report: BdoOrder) -> dict:
         "delivery_zone": report.get("delivery_zone"),
         "operator": report.get("operator"),
         "delivery_status": report.get("delivery_status")
-    }
\ No newline at end of file
+    }
+
+def report_model(report: dict) -> BdoOrder:
+    # El documento ya se valido al escribirse, se construye el modelo sin revalidar
+    data = report_Schema(report)
+    if data["operator"] is not None:
+        data["operator"] = Operator.model_construct(**data["operator"])
+    if data["delivery_status"] is not None:
+        data["delivery_status"] = DeliveryStatus(data["delivery_status"])
+    return BdoOrder.model_construct(**data)
@@ -1,5 +1,16 @@
 from models.user import User
 
+# Campos del usuario sin la contraseña, que solo se lee en el login
+USER_PROJECTION = {
+    "username": 1,
+    "full_name": 1,
+    "first_name": 1,
+    "last_name": 1,
+    "disabled": 1,
+    "zone": 1,
+    "role": 1,
+}
+
 
 def user_Schema(user: User) -> dict:
     return {
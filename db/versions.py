@@ -0,0 +1,33 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from db.client import db_client
+
+# Version de cambios por coleccion (y por zona para reports). Cada escritura la
+# reemplaza por un valor nuevo; los listados arman su ETag con ella sin leer los
+# documentos. Vive en la base de datos para que todos los workers la compartan.
+CHANGE_VERSIONS = "change_versions"
+REPORTS_VERSION_KEY = "reports"
+USERS_VERSION_KEY = "users"
+
+
+def reports_version_key(zone: str | None = None) -> str:
+    return REPORTS_VERSION_KEY if zone is None else f"{REPORTS_VERSION_KEY}:{zone}"
+
+
+def report_version_keys(zones) -> list[str]:
+    # La version global (listado del admin) y la de cada zona afectada
+    zones = sorted({zone for zone in zones if zone is not None})
+    return [REPORTS_VERSION_KEY, *(reports_version_key(zone) for zone in zones)]
+
+
+async def bump_versions(keys: list[str], db=db_client):
+    await db[CHANGE_VERSIONS].bulk_write(
+        [UpdateOne({"_id": key}, {"$set": {"version": str(ObjectId())}}, upsert=True) for key in keys],
+        ordered=False,
+    )
+
+
+async def current_version(key: str, db=db_client) -> str:
+    document = await db[CHANGE_VERSIONS].find_one({"_id": key})
+    return document["version"] if document else "0"
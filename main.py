@@ -1,9 +1,57 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
 from fastapi import FastAPI
-from routers import dash, reports, users
+from routers import dash, health, reports, users
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 
+from db.client import db_client, mongo_settings
+from db.indexes import ensure_indexes
+from utils.events import DASH_CHANGE_STREAMS, watch_report_changes
+from utils.compression import CompressionMiddleware
+from utils.metrics import Counter, Gauge, MetricsMiddleware, collectors, render_metrics
+from utils.passwords import password_hasher
+from utils.response_cache import dash_cache
+from utils.search import user_cache
 
-app = FastAPI()
+# Desde que se importa la app: incluye el costo de importar todos los modulos
+PROCESS_STARTED = time.perf_counter()
+
+load_dotenv()
+
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "true").lower() == "true"
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El cliente de Mongo se crea aqui y no al importar db.client
+    db_client.connect()
+    if mongo_settings.warm_up:
+        await db_client.warm_up()
+
+    # Crear los indices declarados en db/indexes.py (idempotente)
+    if ENSURE_INDEXES:
+        await ensure_indexes()
+
+    # Eventos del dashboard desde el change stream de reports (requiere replica set)
+    watcher = asyncio.create_task(watch_report_changes()) if DASH_CHANGE_STREAMS else None
+
+    app.state.startup_seconds = round(time.perf_counter() - PROCESS_STARTED, 3)
+
+    yield
+
+    if watcher is not None:
+        watcher.cancel()
+    await db_client.close()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.state.process_started = PROCESS_STARTED
+app.state.startup_seconds = None
 
 # Configurar los orígenes permitidos
 origins = [
@@ -12,18 +60,23 @@ origins = [
     # Si necesitas permitir otros orígenes, añádelos aquí.
 ]
 
+app.add_middleware(CompressionMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=6)
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"], 
+    expose_headers=["ETag"],
 )
 
 # Routers
 app.include_router(users.router)
 app.include_router(reports.router)
 app.include_router(dash.router)
+app.include_router(health.router)
 
 
 
@@ -31,3 +84,56 @@ app.include_router(dash.router)
 async def root():
     return {"message": "Hello World"}
 
+
+cache_hits = Counter("cache_hits_total", "In-process cache hits", ("cache",))
+cache_misses = Counter("cache_misses_total", "In-process cache misses", ("cache",))
+cache_entries = Gauge("cache_entries", "In-process cache entries", ("cache",))
+password_hash_active = Gauge("password_hash_active", "bcrypt operations running in the pool")
+password_hash_queued = Gauge("password_hash_queued", "bcrypt operations waiting for a pool slot")
+singleflight_calls = Counter(
+    "singleflight_calls_total", "Dashboard queries executed by the single-flight layer", ("cache",)
+)
+singleflight_coalesced = Counter(
+    "singleflight_coalesced_total", "Dashboard requests served by another request's in-flight query", ("cache",)
+)
+singleflight_in_flight = Gauge("singleflight_in_flight", "Dashboard queries in flight", ("cache",))
+
+
+def collect_component_metrics() -> list[str]:
+    for name, cache in (("users", user_cache), ("dash", dash_cache)):
+        stats = cache.stats()
+        cache_hits.set(name, value=stats["hits"])
+        cache_misses.set(name, value=stats["misses"])
+        cache_entries.set(name, value=stats["size"])
+
+    flight_stats = dash_cache.flights.stats()
+    singleflight_calls.set("dash", value=flight_stats["calls"])
+    singleflight_coalesced.set("dash", value=flight_stats["coalesced"])
+    singleflight_in_flight.set("dash", value=flight_stats["in_flight"])
+
+    hasher_stats = password_hasher.stats()
+    password_hash_active.set(value=hasher_stats["active"])
+    password_hash_queued.set(value=hasher_stats["queued"])
+
+    lines = []
+    for metric in (
+        cache_hits,
+        cache_misses,
+        cache_entries,
+        singleflight_calls,
+        singleflight_coalesced,
+        singleflight_in_flight,
+        password_hash_active,
+        password_hash_queued,
+    ):
+        lines.extend(metric.render())
+    return lines
+
+
+collectors.append(collect_component_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
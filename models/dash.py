@@ -15,15 +15,33 @@ class ReportCount(BaseModel):
     month: Optional[int | str]
     year: int
     total_count: int
+    period: Optional[datetime] = None
 
 class ReportCountResponse(BaseModel):
     reports: List[ReportCount]
-    reports_data: Optional[List[ReportsData]] | None
+    reports_data: Optional[List[ReportsData]] | None = None
+
+class ReportsDataPage(BaseModel):
+    items: List[ReportsData]
+    next_cursor: Optional[str] = None
+
+class ReportFilters(BaseModel):
+    filter: str
+    match_conditions: dict
+    date_field: str
+    start: Optional[datetime] = None
+    end: datetime
+    granularity: str
+    timezone: str
 
 class AverageCompletionTime(BaseModel):
     delivery_zone: str
     destination: str
+    count: int
     average_time: float
+    p50: float
+    p90: float
+    p99: float
 
 class AverageCompletionTimeResponse(BaseModel):
     completion_times: List[AverageCompletionTime]
@@ -35,6 +53,11 @@ class StatusPercentage(BaseModel):
 class StatusPercentageResponse(BaseModel):
     statuses: List[StatusPercentage]
 
+class DashboardOverview(BaseModel):
+    reports: List[ReportCount]
+    statuses: List[StatusPercentage]
+    completion_times: List[AverageCompletionTime]
+
 MONTHS_ES = {
     1: "Ene",
     2: "Feb",
@@ -39,4 +39,15 @@ class BdoOrder(BaseModel):
     delivery_zone: str
     destination: str
     operator: Optional[Operator] | None = None
-    delivery_status: Optional[DeliveryStatus] | None = None
\ No newline at end of file
+    delivery_status: Optional[DeliveryStatus] | None = None
+
+
+class StatusUpdate(BaseModel):
+    report_id: str
+    delivery_status: DeliveryStatus
+
+
+class BulkStatusResult(BaseModel):
+    report_id: str
+    updated: bool
+    detail: Optional[str] | None = None
\ No newline at end of file
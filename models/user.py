@@ -16,6 +16,11 @@ class User(BaseModel):
 class UserDB(User):
     password: str
 
+
+# Documento leido de la base de datos; no se usa como cuerpo de una peticion
+class UserRecord(UserDB):
+    token_version: int = 0
+
 class UserRole(str, Enum):
     admin = "Admin"
     supervisor = "Supervisor"
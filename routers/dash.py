@@ -1,34 +1,236 @@
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.params import Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from models.dash import MONTHS_ES, AverageCompletionTime, AverageCompletionTimeResponse, ReportCount, ReportCountResponse, ReportsData, StatusPercentage, StatusPercentageResponse
-from models.report import DeliveryStatus
+from models.dash import MONTHS_ES, AverageCompletionTime, AverageCompletionTimeResponse, DashboardOverview, ReportCount, ReportCountResponse, ReportFilters, ReportsData, ReportsDataPage, StatusPercentage, StatusPercentageResponse
 from models.user import User, UserRole
-from utils.auth import current_user
-from db.client import db_client
+from utils.auth import STREAM_TOKEN_SECONDS, create_stream_token, current_user, stream_user
+from utils.buckets import series_stages
+from utils.events import merge_events, report_events
+from utils.filters import report_filters
+from utils.response_cache import dash_cache
+from utils.pagination import MAX_PAGE_SIZE, date_keyset_filter, encode_date_cursor, merge_sorted
+from db.archive import range_needs_archive, report_collections, union_archive
+from db.client import analytics_db
+from db.durations import COMPLETION_FIELD
+from db.rollups import ROLLUP_COLLECTION, day_start, rollup_match
 
 router = APIRouter(
     prefix="/dash", tags=["dash"], responses={404: {"message": "Not found"}}
 )
 
+SSE_KEEPALIVE_SECONDS = 15
+COMPLETION_PERCENTILES = [0.5, 0.9, 0.99]
+
+REPORTS_DATA_PROJECTION = {
+    "delivery_date": 1,
+    "creation_date": 1,
+    "bdo_number": 1,
+    "airline": 1,
+    "delivery_status": 1,
+    "destination": 1,
+}
+
+
+def operator_match(filters: ReportFilters) -> dict:
+    # El operador debe tener reportes con el estado pedido, sin importar fechas ni aerolinea
+    operator_conditions = {
+        "delivery_status": filters.match_conditions["delivery_status"],
+        "operator.operator_id": filters.match_conditions["operator.operator_id"],
+    }
+    return {**rollup_match(operator_conditions, "creation_date"), "count": {"$gt": 0}}
+
+
+def uses_daily_rollups(filters: ReportFilters) -> bool:
+    # Los rollups son dias UTC: sirven si los buckets y los limites caen en dias UTC
+    return (
+        filters.granularity != "hour"
+        and filters.timezone == "UTC"
+        and all(date is None or date == day_start(date) for date in (filters.start, filters.end))
+    )
+
+
+def report_counts_pipeline(filters: ReportFilters) -> tuple[str, list[dict]]:
+    # Los rollups ya incluyen los reportes archivados
+    if uses_daily_rollups(filters):
+        collection = ROLLUP_COLLECTION
+        stages = [{"$match": rollup_match(filters.match_conditions, filters.date_field)}]
+        date_path, count = "$day", "$count"
+    else:
+        collection = "reports"
+        stages = [{"$match": filters.match_conditions}]
+        if range_needs_archive(filters.match_conditions, filters.date_field):
+            stages.append(union_archive(filters.match_conditions))
+        date_path, count = f"${filters.date_field}", 1
+
+    return collection, [
+        *stages,
+        *series_stages(
+            date_path, count, filters.start, filters.end, filters.granularity, filters.timezone
+        ),
+    ]
+
+
+def report_counts(rows: list[dict], granularity: str) -> list[ReportCount]:
+    # Los datos vienen de la base de datos ya validados: model_construct evita revalidar cada documento
+    return [
+        ReportCount.model_construct(
+            day=row["period"].day if granularity in ("hour", "day", "week") else None,
+            month=MONTHS_ES.get(row["period"].month) if granularity != "year" else None,
+            year=row["period"].year,
+            total_count=row["total_count"],
+            period=row["period"],
+        )
+        for row in rows
+    ]
+
+
+def completion_times_pipeline(delivery_zone: str | None) -> list[dict]:
+    # Sin zona devuelve la matriz completa zona x destino en una sola consulta
+    match_conditions = {COMPLETION_FIELD: {"$exists": True}}
+    if delivery_zone is not None:
+        match_conditions["delivery_zone"] = delivery_zone
+
+    # Lee la duracion guardada al finalizar el reporte (db/durations.py), tambien
+    # de los archivados: el calculo no tiene rango de fechas
+    return [
+        {"$match": match_conditions},
+        union_archive(match_conditions),
+        {
+            "$group": {
+                "_id": {
+                    "delivery_zone": "$delivery_zone",
+                    "destination": "$destination"
+                },
+                "count": {"$sum": 1},
+                "average_time": {"$avg": f"${COMPLETION_FIELD}"},
+                "percentiles": {
+                    "$percentile": {
+                        "input": f"${COMPLETION_FIELD}",
+                        "p": COMPLETION_PERCENTILES,
+                        "method": "approximate",
+                    }
+                },
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "delivery_zone": "$_id.delivery_zone",
+                "destination": "$_id.destination",
+                "count": 1,
+                "average_time": {"$round": ["$average_time", 2]},
+                "p50": {"$round": [{"$arrayElemAt": ["$percentiles", 0]}, 2]},
+                "p90": {"$round": [{"$arrayElemAt": ["$percentiles", 1]}, 2]},
+                "p99": {"$round": [{"$arrayElemAt": ["$percentiles", 2]}, 2]},
+            }
+        },
+        {"$sort": {"delivery_zone": 1, "destination": 1}},
+    ]
+
+
+def completion_times(rows: list[dict]) -> list[AverageCompletionTime]:
+    return [
+        AverageCompletionTime.model_construct(
+            delivery_zone=row["delivery_zone"],
+            destination=row["destination"],
+            count=row["count"],
+            average_time=row["average_time"],
+            p50=row["p50"],
+            p90=row["p90"],
+            p99=row["p99"],
+        )
+        for row in rows
+    ]
+
+
+def status_counts_pipeline(operator_id: str | None) -> list[dict]:
+    # Cada reporte cuenta una sola vez en los buckets de creation_date
+    match_conditions = {"date_field": "creation_date"}
+    if operator_id:
+        match_conditions["operator_id"] = operator_id
+
+    return [
+        {"$match": match_conditions},
+        {
+            "$group": {
+                "_id": "$delivery_status",
+                "count": {"$sum": "$count"}
+            }
+        },
+        {"$match": {"count": {"$gt": 0}}},
+        {
+            "$project": {
+                "_id": 0,
+                "status": "$_id",
+                "count": 1
+            }
+        }
+    ]
+
+
+def status_percentages(rows: list[dict]) -> list[StatusPercentage]:
+    total_count = sum(row["count"] for row in rows)
+    return [
+        StatusPercentage.model_construct(
+            status=row["status"],
+            percentage=int((row["count"] / total_count) * 100)
+        )
+        for row in rows
+    ]
+
+
 @router.get("/", response_model=ReportCountResponse)
 async def get_reports_count(
+    request: Request,
     user: User = Depends(current_user),
-    filter: str = Query(
-        ...,
-        description="Filter reports by '15 days', 'monthly', 'year', or 'all years'",
-    ),
-    month: int = Query(None, description="Specify the month for 'monthly' filter"),
-    year: int = Query(None, description="Specify the year for 'year' filter"),
-    operator_id: str = Query(
-        None, description="Specify the operator ID to filter reports by operator"
-    ),
-    airline: str = Query(
-        None, description="Specify the airline to filter reports by airline"
-    ),
-    delivery_status: str = Query(
-        None, description="Specify the status to filter reports by status"
+    filters: ReportFilters = Depends(report_filters),
+):
+    if user.role != UserRole.admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
+        )
+
+    # Peticiones iguales en curso comparten la misma consulta (utils/singleflight.py)
+    async def compute(database):
+        if "operator.operator_id" in filters.match_conditions:
+            operator_bucket = await database[ROLLUP_COLLECTION].find_one(operator_match(filters))
+            if operator_bucket is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="The operator has no reports with the specified status",
+                )
+
+        # Los conteos salen de los rollups diarios cuando la granularidad lo permite
+        collection, pipeline = report_counts_pipeline(filters)
+        reports = await (await database[collection].aggregate(pipeline)).to_list()
+
+        # $densify rellena los buckets vacios con cero
+        if not any(report["total_count"] for report in reports):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No reports found for the specified filter",
+            )
+
+        # El detalle de los reportes se pide aparte en /dash/reports-data
+        response = ReportCountResponse.model_construct(
+            reports=report_counts(reports, filters.granularity), reports_data=None
+        )
+
+        return response.model_dump()
+
+    return await dash_cache.fetch(request, (user.role,), compute)
+
+
+@router.get("/overview", response_model=DashboardOverview)
+async def get_dashboard_overview(
+    request: Request,
+    user: User = Depends(current_user),
+    filters: ReportFilters = Depends(report_filters),
+    delivery_zone: str = Query(
+        None, description="Specify the zone for completion times (all zones if omitted)"
     ),
 ):
     if user.role != UserRole.admin:
@@ -36,131 +238,84 @@ async def get_reports_count(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
 
-    match_conditions = {}
+    async def compute(database):
+        operator_id = filters.match_conditions.get("operator.operator_id")
 
-    if delivery_status:
-        match_conditions["delivery_status"] = delivery_status
-    else:
-        match_conditions["delivery_status"] = {
-            "$in": [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]
+        # Una sola agregacion: cada seccion es un $lookup sobre un documento vacio
+        sections = {
+            "reports": report_counts_pipeline(filters),
+            "statuses": (ROLLUP_COLLECTION, status_counts_pipeline(operator_id)),
+            "completion_times": ("reports", completion_times_pipeline(delivery_zone)),
         }
+        if operator_id:
+            sections["operator_reports"] = (
+                ROLLUP_COLLECTION,
+                [{"$match": operator_match(filters)}, {"$limit": 1}],
+            )
 
-    if operator_id:
-        match_conditions["operator.operator_id"] = operator_id
+        pipeline = [{"$documents": [{}]}] + [
+            {"$lookup": {"from": collection, "pipeline": section, "as": name}}
+            for name, (collection, section) in sections.items()
+        ]
+        overview = (await (await database.aggregate(pipeline)).to_list())[0]
 
-        operator_reports_count = db_client.reports.count_documents(match_conditions)
-        if operator_reports_count == 0:
+        if operator_id and not overview["operator_reports"]:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="The operator has no reports with the specified status",
             )
 
-    if airline and airline != "Todas":
-        match_conditions["airline"] = airline
-
-    now = datetime.now()
-
-    if filter == "15 days":
-        start_date = now - timedelta(days=15)
-        if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
-            match_conditions["delivery_date"] = {"$gte": start_date}
-        else:
-            match_conditions["creation_date"] = {"$gte": start_date}
-        group_by = {
-            "day": {"$dayOfMonth": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-            "month": {"$month": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-            "year": {"$year": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-        }
-        sort_by = {"_id.year": 1, "_id.month": 1, "_id.day": 1}
-    elif filter == "monthly":
-        if month is not None and year is not None:
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1)
-            if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
-                match_conditions["delivery_date"] = {"$gte": start_date, "$lt": end_date}
-            else:
-                match_conditions["creation_date"] = {"$gte": start_date, "$lt": end_date}
-        else:
-            start_date = now.replace(day=1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1)
-            if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
-                match_conditions["delivery_date"] = {"$gte": start_date, "$lt": end_date}
-            else:
-                match_conditions["creation_date"] = {"$gte": start_date, "$lt": end_date}
-        group_by = {
-            "day": {"$dayOfMonth": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-            "month": {"$month": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-            "year": {"$year": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-        }
-        sort_by = {"_id.year": 1, "_id.month": 1, "_id.day": 1}
-    elif filter == "year":
-        if year is not None:
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year + 1, 1, 1)
-            if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
-                match_conditions["delivery_date"] = {"$gte": start_date, "$lt": end_date}
-            else:
-                match_conditions["creation_date"] = {"$gte": start_date, "$lt": end_date}
-        else:
-            start_date = now.replace(month=1, day=1)
-            if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
-                match_conditions["delivery_date"] = {"$gte": start_date}
-            else:
-                match_conditions["creation_date"] = {"$gte": start_date}
-        group_by = {
-            "month": {"$month": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-            "year": {"$year": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"},
-        }
-        sort_by = {"_id.year": 1, "_id.month": 1}
-    elif filter == "all years":
-        group_by = {"year": {"$year": "$delivery_date" if "delivery_date" in match_conditions else "$creation_date"}}
-        sort_by = {"_id.year": 1}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid filter value"
+        response = DashboardOverview.model_construct(
+            reports=report_counts(overview["reports"], filters.granularity),
+            statuses=status_percentages(overview["statuses"]),
+            completion_times=completion_times(overview["completion_times"]),
         )
 
-    pipeline = [
-        {"$match": match_conditions},
-        {
-            "$group": {
-                "_id": group_by,
-                "total_count": {"$sum": 1},
-                "reports_data": {
-                    "$push": {
-                        "delivery_date": "$delivery_date",
-                        "creation_date": "$creation_date",
-                        "bdo_number": "$bdo_number",
-                        "airline": "$airline",
-                        "delivery_status": "$delivery_status",
-                        "destination": "$destination",
-                    }
-                },
-            }
-        },
-        {"$sort": sort_by},
-    ]
+        return response.model_dump()
+
+    return await dash_cache.fetch(request, (user.role,), compute)
 
-    reports = list(db_client.reports.aggregate(pipeline))
 
-    if not reports:
+@router.get("/reports-data", response_model=ReportsDataPage)
+async def get_reports_data(
+    user: User = Depends(current_user),
+    filters: ReportFilters = Depends(report_filters),
+    limit: int = Query(
+        100, ge=1, le=MAX_PAGE_SIZE, description="Page size for keyset pagination"
+    ),
+    after: str = Query(
+        None, description="Cursor returned as next_cursor by the previous page"
+    ),
+):
+    if user.role != UserRole.admin:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No reports found for the specified filter",
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
 
-    response = ReportCountResponse(
-        reports=[
-            ReportCount(
-                day=report["_id"].get("day"),
-                month=MONTHS_ES.get(report["_id"].get("month")),
-                year=report["_id"]["year"],
-                total_count=report["total_count"],
-            )
-            for report in reports
-        ],
-        reports_data=[
-            ReportsData(
+    date_field = filters.date_field
+    query = date_keyset_filter(filters.match_conditions, date_field, after)
+    # reports_archive solo se lee si el rango empieza antes del horizonte de archivo
+    cursors = [
+        collection.find(query, REPORTS_DATA_PROJECTION)
+        .sort([(date_field, 1), ("_id", 1)])
+        .limit(limit + 1)
+        for collection in report_collections(analytics_db, filters.match_conditions, date_field)
+    ]
+
+    reports = []
+    async for report in merge_sorted(cursors, key=lambda report: (report[date_field], report["_id"])):
+        reports.append(report)
+        if len(reports) > limit:
+            break
+
+    next_cursor = None
+    if len(reports) > limit:
+        reports = reports[:limit]
+        next_cursor = encode_date_cursor(reports[-1][date_field], reports[-1]["_id"])
+
+    response = ReportsDataPage.model_construct(
+        items=[
+            ReportsData.model_construct(
                 delivery_date=data.get("delivery_date"),
                 creation_date=data.get("creation_date"),
                 bdo_number=data["bdo_number"],
@@ -168,80 +323,46 @@ async def get_reports_count(
                 delivery_status=data["delivery_status"],
                 destination=data["destination"],
             )
-            for report in reports
-            for data in report["reports_data"]
-        ] if filter in ["15 days", "monthly"] else []
+            for data in reports
+        ],
+        next_cursor=next_cursor,
     )
 
-    return response
+    return ORJSONResponse(response.model_dump())
 
-@router.get("/average-completion-times")
-async def get_average_completion_times(delivery_zone: str, user: User = Depends(current_user)):
+@router.get("/average-completion-times", response_model=AverageCompletionTimeResponse)
+async def get_average_completion_times(
+    request: Request,
+    user: User = Depends(current_user),
+    delivery_zone: str = Query(
+        None, description="Specify the zone to filter by zone (all zones if omitted)"
+    ),
+):
     if user.role != UserRole.admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
 
-    pipeline = [
-        {
-            "$match": {
-                "delivery_zone": delivery_zone,
-                "delivery_status": {"$in": [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]},
-            }
-        },
-        {
-            "$project": {
-                "delivery_zone": 1,
-                "destination": 1,
-                "time_to_complete": {
-                    "$divide": [
-                        {"$subtract": ["$delivery_date", "$creation_date"]},
-                        1000 * 60 * 60  # Convert milliseconds to hours
-                    ]
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "delivery_zone": "$delivery_zone",
-                    "destination": "$destination"
-                },
-                "average_time": {"$avg": "$time_to_complete"}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "delivery_zone": "$_id.delivery_zone",
-                "destination": "$_id.destination",
-                "average_time": {"$round": ["$average_time", 2]}
-            }
-        }
-    ]
+    async def compute(database):
+        pipeline = completion_times_pipeline(delivery_zone)
+        result = await (await database.reports.aggregate(pipeline)).to_list()
 
-    result = list(db_client.reports.aggregate(pipeline))
+        if not result:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="No completed reports found for the given delivery zone"
+            )
 
-    if not result:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="No completed reports found for the given delivery zone"
+        response = AverageCompletionTimeResponse.model_construct(
+            completion_times=completion_times(result)
         )
-    
-    response = AverageCompletionTimeResponse(
-        completion_times=[
-            AverageCompletionTime(
-                delivery_zone=item["delivery_zone"],
-                destination=item["destination"],
-                average_time=item["average_time"]
-            )
-            for item in result
-        ]
-    )
 
-    return response
+        return response.model_dump()
+
+    return await dash_cache.fetch(request, (user.role,), compute)
 
 @router.get("/status-percentages", response_model=StatusPercentageResponse)
 async def get_status_percentages(
+    request: Request,
     user: User = Depends(current_user),
     operator_id: str = Query(None, description="Specify the operator ID to filter reports by operator")
 ):
@@ -250,42 +371,66 @@ async def get_status_percentages(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
 
-    match_conditions = {}
-    if operator_id:
-        match_conditions["operator.operator_id"] = operator_id
+    async def compute(database):
+        pipeline = status_counts_pipeline(operator_id)
+        result = await (await database[ROLLUP_COLLECTION].aggregate(pipeline)).to_list()
 
-    pipeline = [
-        {"$match": match_conditions},
-        {
-            "$group": {
-                "_id": "$delivery_status",
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "status": "$_id",
-                "count": 1
-            }
-        }
-    ]
+        if not result:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="No reports found"
+            )
+
+        response = StatusPercentageResponse.model_construct(statuses=status_percentages(result))
+        return response.model_dump()
 
-    result = list(db_client.reports.aggregate(pipeline))
+    return await dash_cache.fetch(request, (user.role,), compute)
 
-    if not result:
+
+@router.post("/stream-token")
+async def get_stream_token(user: User = Depends(current_user)):
+    if user.role != UserRole.admin:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="No reports found"
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
 
-    total_count = sum(item["count"] for item in result)
-    status_percentages = [
-        StatusPercentage(
-            status=item["status"],
-            percentage=int((item["count"] / total_count) * 100)
+    # El token de acceso no va en la URL de /dash/stream: se cambia por uno corto
+    return {
+        "token": create_stream_token(user),
+        "token_type": "stream",
+        "expires_in": STREAM_TOKEN_SECONDS,
+    }
+
+
+@router.get("/stream")
+async def stream_dashboard_updates(user: User = Depends(stream_user)):
+    if user.role != UserRole.admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
         )
-        for item in result
-    ]
 
-    response = StatusPercentageResponse(statuses=status_percentages)
-    return response
\ No newline at end of file
+    # Server-Sent Events: cambios en conteos y estados a medida que se escriben reportes
+    async def events():
+        queue = report_events.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Los eventos acumulados mientras se enviaba el anterior salen juntos
+                pending = [event]
+                while not queue.empty():
+                    pending.append(queue.get_nowait())
+                data = orjson.dumps(merge_events(pending)).decode()
+                yield f"event: dashboard\ndata: {data}\n\n"
+        finally:
+            report_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from fastapi import APIRouter, Request, status
+from fastapi.responses import ORJSONResponse
+from pymongo.errors import PyMongoError
+
+from db.client import db_client
+
+load_dotenv()
+
+HEALTH_PING_TIMEOUT = float(os.getenv("HEALTH_PING_TIMEOUT", "2"))
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live")
+async def liveness(request: Request):
+    # Solo indica que el proceso responde: no consulta la base de datos
+    return {
+        "status": "ok",
+        "uptime_seconds": round(time.perf_counter() - request.app.state.process_started, 3),
+    }
+
+
+@router.get("/ready")
+async def readiness(request: Request):
+    ready = True
+    error = None
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db_client.command("ping"), HEALTH_PING_TIMEOUT)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        ready = False
+        error = type(e).__name__
+
+    content = {
+        "status": "ready" if ready else "unavailable",
+        "ping_seconds": round(time.perf_counter() - started, 4),
+        "startup_seconds": request.app.state.startup_seconds,
+        "pool": db_client.pool_state(),
+    }
+    if error is not None:
+        content["error"] = error
+
+    return ORJSONResponse(
+        content,
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
@@ -1,16 +1,34 @@
-from datetime import time, datetime
+from datetime import datetime
+from typing import List
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, status
-from db.schema.report_schema import report_Schema
-from models.report import BdoOrder, DeliveryStatus
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import ORJSONResponse
+from db.schema.report_schema import REPORT_PROJECTION, report_Schema, report_model
+from models.dash import ReportFilters
+from models.report import BdoOrder, BulkStatusResult, DeliveryStatus, StatusUpdate
 from models.user import User, UserRole
 from utils.auth import current_user
-from db.client import db_client
+from utils.etags import etag_headers, etag_matches, not_modified, weak_etag
+from utils.export import EXPORT_BATCH_SIZE, csv_response, xlsx_response
+from utils.filters import report_filters
+from utils.pagination import MAX_PAGE_SIZE, keyset_filter, merge_sorted, paginate, stream_ndjson
+from db.archive import ARCHIVE_COLLECTION, report_collections
+from db.client import analytics_db, db_client
+from db.durations import COMPLETION_FIELD, completion_hours, completion_hours_expression
+from db.rollups import apply_report_change, apply_report_changes
+from db.versions import bump_versions, current_version, report_version_keys, reports_version_key
+from utils.events import publish_report_deltas
+from utils.response_cache import dash_cache
 
 router = APIRouter(
     prefix="/reports", tags=["reports"], responses={404: {"message": "Not found"}}
 )
 
+MAX_BULK_SIZE = 1000
+WRITE_TOKEN_FIELD = "write_token"
+
 
 def status_checker(current_status: DeliveryStatus, new_status: DeliveryStatus):
     if new_status <= current_status:
@@ -39,19 +57,75 @@ def status_checker(current_status: DeliveryStatus, new_status: DeliveryStatus):
 
 
 @router.get("/")
-async def get_reports(user: User = Depends(current_user)):
+async def get_reports(
+    request: Request,
+    user: User = Depends(current_user),
+    limit: int = Query(
+        None, ge=1, le=MAX_PAGE_SIZE, description="Page size for keyset pagination"
+    ),
+    after: str = Query(
+        None, description="Cursor returned as next_cursor by the previous page"
+    ),
+    stream: bool = Query(
+        False, description="Stream reports as NDJSON while the cursor yields them"
+    ),
+):
     if user.role == UserRole.admin:
-        reports = db_client.reports.find()
-        return [report_Schema(report) for report in reports]
+        query = {}
+        version_key = reports_version_key()
     else:
-        reports = db_client.reports.find({"delivery_zone": user.zone})
-        return [report_Schema(report) for report in reports]
+        query = {"delivery_zone": user.zone}
+        version_key = reports_version_key(user.zone)
 
+    # La version se lee antes que los reportes: si cambia en medio, el ETag
+    # queda viejo y el siguiente polling recibe la respuesta completa
+    etag = weak_etag(
+        await current_version(version_key),
+        user.role,
+        user.zone,
+        sorted(request.query_params.multi_items()),
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-@router.post("/", response_model=BdoOrder, status_code=status.HTTP_201_CREATED)
-async def create_report(report: BdoOrder, user: User = Depends(current_user)):
-    new_report = {
-        "creation_date": datetime.now(),
+    if stream:
+        reports = db_client.reports.find(
+            keyset_filter(query, after), REPORT_PROJECTION
+        ).sort("_id", 1)
+        response = stream_ndjson(reports, report_Schema)
+    elif limit is not None:
+        page = await paginate(
+            db_client.reports, query, report_Schema, limit, after, REPORT_PROJECTION
+        )
+        response = ORJSONResponse(page)
+    else:
+        reports = db_client.reports.find(keyset_filter(query, after), REPORT_PROJECTION)
+        response = ORJSONResponse([report_Schema(report) async for report in reports])
+
+    response.headers.update(etag_headers(etag))
+    return response
+
+
+def allowed_previous_statuses(new_status: DeliveryStatus) -> list[str]:
+    allowed = []
+    for current_status in DeliveryStatus:
+        try:
+            status_checker(current_status, new_status)
+        except HTTPException:
+            continue
+        allowed.append(current_status.value)
+    return allowed
+
+
+def mongo_now() -> datetime:
+    # Mongo guarda milisegundos: se trunca para que el documento local coincida con el guardado
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def new_report_document(report: BdoOrder, user: User, creation_date: datetime) -> dict:
+    return {
+        "creation_date": creation_date,
         "airline": report.airline,
         "reference_number": report.reference_number,
         "bdo_number": report.bdo_number,
@@ -61,39 +135,82 @@ async def create_report(report: BdoOrder, user: User = Depends(current_user)):
         "delivery_status": DeliveryStatus.pending,
     }
 
-    report_id = db_client.reports.insert_one(new_report).inserted_id
-
-    retries = 5
-    new_report = None
-    for _ in range(retries):
-        new_report = db_client.reports.find_one({"_id": report_id})
-        if new_report:
-            break
-        time.sleep(0.1)  # Esperar un poco antes de intentar de nuevo
 
-    if not new_report:
+def check_bulk_size(items: list):
+    if len(items) > MAX_BULK_SIZE:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Report creation failed"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch cannot contain more than {MAX_BULK_SIZE} items",
         )
 
-    new_report = report_Schema(new_report)
 
-    return BdoOrder(**new_report)
+@router.get("/export")
+async def export_reports(
+    user: User = Depends(current_user),
+    filters: ReportFilters = Depends(report_filters),
+    delivery_zone: str = Query(
+        None, description="Specify the zone to filter reports by zone"
+    ),
+    format: str = Query(
+        "csv", pattern="^(csv|xlsx)$", description="Export format: 'csv' or 'xlsx'"
+    ),
+):
+    match_conditions = dict(filters.match_conditions)
+
+    # Mismo alcance que get_reports: solo el admin ve todas las zonas
+    if user.role != UserRole.admin:
+        match_conditions["delivery_zone"] = user.zone
+    elif delivery_zone:
+        match_conditions["delivery_zone"] = delivery_zone
+
+    date_field = filters.date_field
+    cursors = [
+        collection.find(match_conditions, REPORT_PROJECTION)
+        .sort([(date_field, 1), ("_id", 1)])
+        .batch_size(EXPORT_BATCH_SIZE)
+        for collection in report_collections(analytics_db, match_conditions, date_field)
+    ]
+    reports = merge_sorted(cursors, key=lambda report: (report[date_field], report["_id"]))
+
+    filename = f"reports_{datetime.now():%Y%m%d_%H%M%S}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "xlsx":
+        return await xlsx_response(reports, headers)
+    return csv_response(reports, headers)
+
+
+@router.post("/", response_model=BdoOrder, status_code=status.HTTP_201_CREATED)
+async def create_report(report: BdoOrder, user: User = Depends(current_user)):
+    new_report = new_report_document(report, user, mongo_now())
+
+    # El reporte y sus rollups se guardan juntos: si falla uno no queda ninguno,
+    # y un reintento del cliente no duplica el reporte
+    async def write(session):
+        # insert_one agrega el _id al documento: la respuesta se arma sin volver a leerlo
+        await db_client.reports.insert_one(new_report, session=session)
+        return await apply_report_change(None, new_report, session=session)
+
+    deltas = await db_client.transaction(write)
+    await bump_versions(report_version_keys([new_report["delivery_zone"]]))
+    dash_cache.bump()
+    publish_report_deltas(deltas)
+
+    return report_model(new_report)
 
 
 @router.put("/", response_model=BdoOrder, status_code=status.HTTP_200_OK)
 async def update_report_status(
     report_id: str, delivery_status: str, user: User = Depends(current_user)
 ):
-    report = db_client.reports.find_one({"_id": ObjectId(report_id)})
-
-    if not report:
+    try:
+        object_id = ObjectId(report_id)
+    except InvalidId:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Report not found"
         )
 
     try:
-        current_status = DeliveryStatus(report["delivery_status"])
         new_status = DeliveryStatus(delivery_status)
     except ValueError as e:
         raise HTTPException(
@@ -101,24 +218,199 @@ async def update_report_status(
             detail=f"Invalid delivery status: {e}",
         )
 
-    status_checker(current_status, new_status)
-
+    new_values = {"delivery_status": new_status.value}
+    update_values = dict(new_values)
     if new_status == DeliveryStatus.completed:
-        db_client.reports.update_one(
-            {"_id": ObjectId(report_id)},
+        new_values["delivery_date"] = update_values["delivery_date"] = mongo_now()
+        # La duracion se calcula en el servidor con el creation_date guardado
+        update_values[COMPLETION_FIELD] = completion_hours_expression(new_values["delivery_date"])
+
+    async def write(session):
+        # El filtro solo acepta los estados desde los que status_checker permite
+        # pasar al nuevo; el cambio y sus rollups van en la misma transaccion
+        report = await db_client.reports.find_one_and_update(
             {
-                "$set": {
-                    "delivery_status": delivery_status,
-                    "delivery_date": datetime.now(),
-                }
+                "_id": object_id,
+                "delivery_status": {"$in": allowed_previous_statuses(new_status)},
             },
+            [{"$set": update_values}],
+            return_document=ReturnDocument.BEFORE,
+            session=session,
         )
-    else:
-        db_client.reports.update_one(
-            {"_id": ObjectId(report_id)}, {"$set": {"delivery_status": delivery_status}}
+        if not report:
+            return None, None, None
+
+        changed_values = dict(new_values)
+        if "delivery_date" in changed_values:
+            changed_values[COMPLETION_FIELD] = completion_hours(
+                report["creation_date"], changed_values["delivery_date"]
+            )
+        updated_report = {**report, **changed_values}
+        deltas = await apply_report_change(report, updated_report, session=session)
+        return report, updated_report, deltas
+
+    report, updated_report, deltas = await db_client.transaction(write)
+
+    if not report:
+        # Solo en el caso de error se lee el reporte para explicar el rechazo
+        report = await db_client.reports.find_one({"_id": object_id}, {"delivery_status": 1})
+        if not report:
+            # Los archivados son Facturado: status_checker explica el rechazo
+            report = await db_client[ARCHIVE_COLLECTION].find_one(
+                {"_id": object_id}, {"delivery_status": 1}
+            )
+        if not report:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Report not found"
+            )
+        status_checker(DeliveryStatus(report["delivery_status"]), new_status)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Report status changed, try again",
+        )
+
+    await bump_versions(report_version_keys([report["delivery_zone"]]))
+    dash_cache.bump()
+    publish_report_deltas(deltas)
+
+    return report_model(updated_report)
+
+
+@router.post("/bulk", response_model=List[BdoOrder], status_code=status.HTTP_201_CREATED)
+async def create_reports(reports: List[BdoOrder], user: User = Depends(current_user)):
+    check_bulk_size(reports)
+    if not reports:
+        return []
+
+    creation_date = mongo_now()
+    new_reports = [new_report_document(report, user, creation_date) for report in reports]
+
+    async def write(session):
+        # insert_many agrega el _id a cada documento
+        await db_client.reports.insert_many(new_reports, session=session)
+        return await apply_report_changes(
+            [(None, new_report) for new_report in new_reports], session=session
         )
 
-    updated_report = db_client.reports.find_one({"_id": ObjectId(report_id)})
-    updated_report = report_Schema(updated_report)
+    deltas = await db_client.transaction(write)
+    await bump_versions(report_version_keys(new_report["delivery_zone"] for new_report in new_reports))
+    dash_cache.bump()
+    publish_report_deltas(deltas)
+
+    return [report_model(new_report) for new_report in new_reports]
+
+
+@router.put("/bulk-status", response_model=List[BulkStatusResult], status_code=status.HTTP_200_OK)
+async def update_reports_status(updates: List[StatusUpdate], user: User = Depends(current_user)):
+    check_bulk_size(updates)
 
-    return BdoOrder(**updated_report)
\ No newline at end of file
+    errors = {}
+    object_ids = []
+    for update in updates:
+        if update.report_id in errors:
+            continue
+        try:
+            object_ids.append(ObjectId(update.report_id))
+        except InvalidId:
+            errors[update.report_id] = "Invalid report id"
+
+    reports = {
+        str(report["_id"]): report
+        async for report in db_client.reports.find({"_id": {"$in": object_ids}})
+    }
+    missing_ids = [object_id for object_id in object_ids if str(object_id) not in reports]
+    if missing_ids:
+        # Los archivados son Facturado: status_checker rechaza cualquier cambio
+        async for report in db_client[ARCHIVE_COLLECTION].find(
+            {"_id": {"$in": missing_ids}}, {"delivery_status": 1}
+        ):
+            reports[str(report["_id"])] = report
+
+    # Se validan todas las transiciones con status_checker antes de escribir
+    now = mongo_now()
+    changes = {}
+    for update in updates:
+        if update.report_id in errors:
+            continue
+        if update.report_id in changes:
+            errors[update.report_id] = "Duplicate report id in batch"
+            del changes[update.report_id]
+            continue
+
+        report = reports.get(update.report_id)
+        if report is None:
+            errors[update.report_id] = "Report not found"
+            continue
+
+        try:
+            status_checker(DeliveryStatus(report["delivery_status"]), update.delivery_status)
+        except HTTPException as e:
+            errors[update.report_id] = e.detail
+            continue
+
+        new_values = {"delivery_status": update.delivery_status.value}
+        if update.delivery_status == DeliveryStatus.completed:
+            new_values["delivery_date"] = now
+            new_values[COMPLETION_FIELD] = completion_hours(report["creation_date"], now)
+        changes[update.report_id] = (report, {**report, **new_values})
+
+    # El filtro incluye el estado leido: si otro proceso lo cambio, la operacion no aplica.
+    # write_token marca las filas que escribio esta peticion y no otra con la misma transicion
+    write_token = ObjectId()
+    operations = [
+        UpdateOne(
+            {"_id": before["_id"], "delivery_status": before["delivery_status"]},
+            {"$set": {
+                **{key: after[key] for key in ("delivery_status", "delivery_date", COMPLETION_FIELD) if key in after},
+                WRITE_TOKEN_FIELD: write_token,
+            }},
+        )
+        for before, after in changes.values()
+    ]
+
+    async def write(session):
+        # Cada intento de la transaccion parte de las mismas candidatas
+        applied = dict(changes)
+        result = await db_client.reports.bulk_write(operations, ordered=False, session=session)
+
+        conflicts = []
+        if result.matched_count < len(operations):
+            # Alguna fila cambio entre la lectura y la escritura: solo cuentan las
+            # que llevan el token de esta peticion
+            written = {
+                str(report["_id"])
+                async for report in db_client.reports.find(
+                    {
+                        "_id": {"$in": [before["_id"] for before, _ in applied.values()]},
+                        WRITE_TOKEN_FIELD: write_token,
+                    },
+                    {"_id": 1},
+                    session=session,
+                )
+            }
+            for report_id in list(applied):
+                if report_id not in written:
+                    conflicts.append(report_id)
+                    del applied[report_id]
+
+        deltas = await apply_report_changes(list(applied.values()), session=session)
+        return applied, conflicts, deltas
+
+    if operations:
+        changes, conflicts, deltas = await db_client.transaction(write)
+        for report_id in conflicts:
+            errors[report_id] = "Report was modified concurrently"
+
+        if changes:
+            await bump_versions(report_version_keys(after["delivery_zone"] for _, after in changes.values()))
+        dash_cache.bump()
+        publish_report_deltas(deltas)
+
+    return [
+        BulkStatusResult(
+            report_id=update.report_id,
+            updated=update.report_id in changes,
+            detail=errors.get(update.report_id),
+        )
+        for update in updates
+    ]
\ No newline at end of file
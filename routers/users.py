@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt
-from passlib.context import CryptContext
-from datetime import datetime, time, timedelta, timezone
+from datetime import datetime, timedelta, timezone
+import re
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from models.user import User, UserDB, UserRole
 
 from dotenv import load_dotenv
 import os
 
-from utils.auth import current_user
-from utils.search import serch_user_db
+from utils.auth import JWT_EMBED_CLAIMS, current_user, token_revocations, user_claims
+from utils.passwords import password_hasher
+from utils.search import serch_user_db, user_cache
+from utils.etags import etag_headers, etag_matches, not_modified, weak_etag
+from utils.pagination import MAX_PAGE_SIZE, keyset_filter, paginate, stream_ndjson
 
-from db.schema.user_schema import user_Schema
+from db.schema.user_schema import USER_PROJECTION, user_Schema
 from db.client import db_client
+from db.versions import USERS_VERSION_KEY, bump_versions, current_version
 from fastapi import Form
+from fastapi.responses import ORJSONResponse
 
 
 load_dotenv()
@@ -30,21 +37,42 @@ router = APIRouter(
 
 oauth2 = OAuth2PasswordBearer(tokenUrl="login")
 
-crypt = CryptContext(schemes=["bcrypt"])
+MAX_USERNAME_ATTEMPTS = 5
 
 
-def generate_username(first_name: str, last_name: str) -> str:
+async def taken_username_sequence(prefix: str) -> int:
+    # Mayor secuencia ya usada por usuarios existentes (AB -> 1, AB1 -> 2, ...).
+    # Solo se consulta la primera vez que aparece un prefijo; la regex anclada usa el indice de username
+    sequence = 0
+    users = db_client.users.find(
+        {"username": {"$regex": f"^{re.escape(prefix)}[0-9]*$"}}, {"username": 1}
+    )
+    async for user in users:
+        suffix = user["username"][len(prefix):]
+        sequence = max(sequence, int(suffix) + 1 if suffix else 1)
+    return sequence
+
+
+async def generate_username(first_name: str, last_name: str) -> str:
     username = ''.join([name[0].upper() for name in first_name.split() + last_name.split()])
 
-    # Asegurarse de que el username sea único
-    initial_username = username
-    counter = 1
+    # Contador atomico por prefijo: un solo round trip y sin carreras entre creaciones concurrentes
+    counter = await db_client.username_counters.find_one_and_update(
+        {"_id": username}, {"$inc": {"sequence": 1}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        # Primer uso del prefijo: se parte de los usernames que ya existen
+        taken = await taken_username_sequence(username)
+        await db_client.username_counters.update_one(
+            {"_id": username}, {"$max": {"sequence": taken}}, upsert=True
+        )
+        counter = await db_client.username_counters.find_one_and_update(
+            {"_id": username}, {"$inc": {"sequence": 1}}, return_document=ReturnDocument.AFTER
+        )
 
-    #aqui se conecta y encuentra el nombre de usuario
-    while db_client.users.find_one({"username": username}):
-        username = initial_username + str(counter)
-        counter += 1
-    return username
+    # La secuencia 1 es el prefijo solo, luego AB1, AB2, ...
+    sequence = counter["sequence"]
+    return username if sequence == 1 else username + str(sequence - 1)
 
 
 #modificacion del endpoint para que busque en mi bd y no en mi lista local
@@ -52,7 +80,7 @@ def generate_username(first_name: str, last_name: str) -> str:
 async def login(form: OAuth2PasswordRequestForm = Depends()):
 
     # Buscar el usuario directamente en la base de datos de MongoDB
-    user = serch_user_db(form.username)
+    user = await serch_user_db(form.username)
     
     if not user:
         raise HTTPException(
@@ -60,7 +88,7 @@ async def login(form: OAuth2PasswordRequestForm = Depends()):
         )
 
     # Verificar la contraseña
-    if not crypt.verify(form.password, user.password):  # Usar claves del diccionario
+    if not await password_hasher.verify(form.password, user.password):  # Usar claves del diccionario
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect password"
         )
@@ -69,10 +97,12 @@ async def login(form: OAuth2PasswordRequestForm = Depends()):
     acces_token_expires = timedelta(minutes=ACCESS_TOKEN_DURATION)
     expire = datetime.now(timezone.utc) + acces_token_expires
 
+    claims = {"sub": user.username, "exp": expire}
+    if JWT_EMBED_CLAIMS:
+        claims.update(user_claims(user))
+
     # Generar el token JWT
-    acces_token = jwt.encode(
-        {"sub": user.username, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM
-    )
+    acces_token = jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
     
     # Devolver el token como respuesta
     return {"token": acces_token, "token_type": "bearer", "role": user.role}
@@ -84,11 +114,54 @@ async def me(my_user: User = Depends(current_user)):
     return my_user
 
 
+@router.get("/cache-stats")
+async def get_user_cache_stats(user: User = Depends(current_user)):
+    if user.role != UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return user_cache.stats()
+
+
+@router.get("/hasher-stats")
+async def get_password_hasher_stats(user: User = Depends(current_user)):
+    if user.role != UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return password_hasher.stats()
+
+
 #cambio para que retorne directamente esa lista en mi bd.
 @router.get("/all")
-async def get_users(user: User = Depends(current_user)):
-    users = db_client.users.find()  # Obtener todos los usuarios de MongoDB
-    return [user_Schema(user) for user in users]  # Convertir cada documento al esquema de usuario
+async def get_users(
+    request: Request,
+    user: User = Depends(current_user),
+    limit: int = Query(
+        None, ge=1, le=MAX_PAGE_SIZE, description="Page size for keyset pagination"
+    ),
+    after: str = Query(
+        None, description="Cursor returned as next_cursor by the previous page"
+    ),
+    stream: bool = Query(
+        False, description="Stream users as NDJSON while the cursor yields them"
+    ),
+):
+    # Si la version no cambio desde el ultimo polling se responde 304 sin leer usuarios
+    etag = weak_etag(
+        await current_version(USERS_VERSION_KEY), sorted(request.query_params.multi_items())
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    if stream:
+        users = db_client.users.find(keyset_filter({}, after), USER_PROJECTION).sort("_id", 1)
+        response = stream_ndjson(users, user_Schema)
+    elif limit is not None:
+        page = await paginate(db_client.users, {}, user_Schema, limit, after, USER_PROJECTION)
+        response = ORJSONResponse(page)
+    else:
+        users = db_client.users.find(keyset_filter({}, after), USER_PROJECTION)  # Obtener todos los usuarios de MongoDB
+        response = ORJSONResponse([user_Schema(user) async for user in users])  # Convertir cada documento al esquema de usuario
+
+    response.headers.update(etag_headers(etag))
+    return response
 
 
 
@@ -99,11 +172,9 @@ async def create_user(user_db: UserDB, user: User = Depends(current_user)):
     if user.role == UserRole.operator:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized user")
 
-    username = generate_username(user_db.first_name, user_db.last_name)
-    hashed_password = crypt.hash(user_db.password)
+    hashed_password = await password_hasher.hash(user_db.password)
 
     new_user_dict = {
-        "username": username,
         "full_name": f"{user_db.first_name} {user_db.last_name}",
         "first_name": user_db.first_name,
         "last_name": user_db.last_name,
@@ -113,23 +184,22 @@ async def create_user(user_db: UserDB, user: User = Depends(current_user)):
         "password": hashed_password
     }
 
-    # Insertar el usuario en la base de datos
-    user_id = db_client.users.insert_one(new_user_dict).inserted_id
-
-    # Intentar recuperar el nuevo usuario creado desde la base de datos
-    retries = 5
-    new_user = None
-    for _ in range(retries):
-        new_user = db_client.users.find_one({"_id": user_id})
-        if new_user:
+    # Insertar el usuario en la base de datos (insert_one agrega el _id al diccionario).
+    # Si el username ya existe (indice unico), se pide el siguiente del contador
+    for attempt in range(MAX_USERNAME_ATTEMPTS):
+        new_user_dict["username"] = await generate_username(user_db.first_name, user_db.last_name)
+        try:
+            await db_client.users.insert_one(new_user_dict)
             break
-        time.sleep(0.1)  # Esperar un poco antes de intentar de nuevo
+        except DuplicateKeyError:
+            if attempt == MAX_USERNAME_ATTEMPTS - 1:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Could not allocate a unique username")
 
-    if not new_user:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="User creation failed")
+    user_cache.invalidate(new_user_dict["username"])
+    await bump_versions([USERS_VERSION_KEY])
 
-    # Convertir el nuevo usuario a un esquema de usuario
-    new_user = user_Schema(new_user)
+    # Convertir el nuevo usuario a un esquema de usuario sin volver a leerlo
+    new_user = user_Schema(new_user_dict)
 
     # Devolver el nuevo usuario como respuesta
     return User(**new_user)
@@ -143,16 +213,21 @@ async def change_user_role(user_id: str, new_role: UserRole, current_user: User
     if current_user.role != UserRole.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized to change role")
 
-    # Busqueando el usuario a modificar en la base de datos
-    user_to_modify = db_client.users.find_one({"_id": ObjectId(user_id)})
+    # Actualizacion del rol del usuario en la base de datos, en una sola operacion
+    # Subir la version del token invalida los tokens emitidos con el rol anterior
+    updated_user = await db_client.users.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$set": {"role": new_role}, "$inc": {"token_version": 1}},
+        projection={**USER_PROJECTION, "token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
 
-    if not user_to_modify:
+    if not updated_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    # Actualizacion del rol del usuario en la base de datos
-    db_client.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"role": new_role}})
-
-    updated_user = db_client.users.find_one({"_id": ObjectId(user_id)})
+    user_cache.invalidate(updated_user["username"])
+    token_revocations.bump(updated_user["username"], updated_user["token_version"])
+    await bump_versions([USERS_VERSION_KEY])
     updated_user = user_Schema(updated_user)
 
     # reornamiento de una respuesta de éxito
@@ -167,7 +242,7 @@ async def change_password(user_id: str, password_request: str = Form(...), curre
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operators cannot change passwords")
 
     # Buscar el usuario al que se desea cambiar la contraseña por su ID
-    user_to_modify = db_client.users.find_one({"_id": ObjectId(user_id)})
+    user_to_modify = await db_client.users.find_one({"_id": ObjectId(user_id)})
 
     if not user_to_modify:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -177,8 +252,20 @@ async def change_password(user_id: str, password_request: str = Form(...), curre
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Supervisors can only change Operator passwords")
 
     # Si todo está correcto, proceder con el cambio de contraseña
-    hashed_password = crypt.hash(password_request)
-    db_client.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"password": hashed_password}})
+    hashed_password = await password_hasher.hash(password_request)
+    updated_user = await db_client.users.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$set": {"password": hashed_password}, "$inc": {"token_version": 1}},
+        projection={"username": 1, "token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+
+    # El usuario pudo borrarse entre la lectura y la actualizacion
+    if not updated_user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    user_cache.invalidate(user_to_modify["username"])
+    token_revocations.bump(updated_user["username"], updated_user["token_version"])
 
     return {"message": f"Password updated for user with ID {user_id}"}
 
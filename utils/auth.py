@@ -1,10 +1,13 @@
 import os
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from fastapi import Depends, status, HTTPException
+from fastapi import Depends, Query, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError,jwt
 
-from models.user import User
+from db.client import db_client
+from models.user import User, UserRecord
 from utils.search import serch_user
 
 load_dotenv()
@@ -12,25 +15,120 @@ load_dotenv()
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_DURATION = int(os.getenv("ACCESS_TOKEN_DURATION"))
 SECRET_KEY = os.getenv("SECRET_KEY")
+# Modo opcional: rol, zona y estado del usuario viajan dentro del token
+JWT_EMBED_CLAIMS = os.getenv("JWT_EMBED_CLAIMS", "false").lower() == "true"
+TOKEN_REVOCATION_REFRESH = float(os.getenv("TOKEN_REVOCATION_REFRESH", "30"))
+# Token de corta duracion que solo sirve para /dash/stream (viaja en la URL)
+STREAM_TOKEN_SCOPE = "dash-stream"
+STREAM_TOKEN_SECONDS = int(os.getenv("STREAM_TOKEN_SECONDS", "60"))
 
 oauth2 = OAuth2PasswordBearer(tokenUrl="login")
 
-async def auth_user(token: str = Depends(oauth2)):
-    exception = HTTPException(
+
+class TokenRevocations:
+    # Version minima de token vigente por usuario y usuarios deshabilitados.
+    # Solo se guardan los usuarios que alguna vez cambiaron, y se recarga desde
+    # la base de datos cada TOKEN_REVOCATION_REFRESH segundos para ver los
+    # cambios hechos en otros workers.
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.versions: dict[str, int] = {}
+        self.disabled: set[str] = set()
+        self._refreshed_at = float("-inf")
+
+    async def refresh_if_stale(self):
+        now = time.monotonic()
+        if now - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshed_at = now
+
+        versions = {}
+        disabled = set()
+        users = db_client.users.find(
+            {"$or": [{"token_version": {"$gt": 0}}, {"disabled": True}]},
+            {"username": 1, "token_version": 1, "disabled": 1},
+        )
+        async for user in users:
+            versions[user["username"]] = user.get("token_version", 0)
+            if user.get("disabled"):
+                disabled.add(user["username"])
+
+        self.versions = versions
+        self.disabled = disabled
+
+    def bump(self, username: str, version: int):
+        if version > self.versions.get(username, 0):
+            self.versions[username] = version
+
+    def is_valid(self, username: str, version: int) -> bool:
+        return username not in self.disabled and version >= self.versions.get(username, 0)
+
+
+token_revocations = TokenRevocations(TOKEN_REVOCATION_REFRESH)
+
+
+def user_claims(user: UserRecord) -> dict:
+    return {
+        "uid": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "full_name": user.full_name,
+        "role": user.role,
+        "zone": user.zone,
+        "disabled": user.disabled,
+        "ver": user.token_version,
+    }
+
+
+def create_stream_token(user: User) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(seconds=STREAM_TOKEN_SECONDS)
+    claims = {"sub": user.username, "exp": expire, "scope": STREAM_TOKEN_SCOPE}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def decode_token(token: str, scope: str | None = None) -> dict:
+    # Los tokens de acceso no tienen scope; uno con scope solo vale para su uso
     try:
-        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
-        if username is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception()
+
+    if payload.get("sub") is None or payload.get("scope") != scope:
+        raise credentials_exception()
+    return payload
+
+
+async def auth_user(token: str = Depends(oauth2)):
+    exception = credentials_exception()
+    payload = decode_token(token)
+    username = payload["sub"]
+
+    # Token con los datos del usuario: no hace falta consultar la base de datos
+    if JWT_EMBED_CLAIMS and "role" in payload:
+        await token_revocations.refresh_if_stale()
+        if not token_revocations.is_valid(username, payload.get("ver", 0)):
             raise exception
 
-    except JWTError:
-        raise exception
+        return User.model_construct(
+            id=payload.get("uid"),
+            username=username,
+            full_name=payload.get("full_name"),
+            first_name=payload.get("first_name"),
+            last_name=payload.get("last_name"),
+            role=payload["role"],
+            zone=payload.get("zone"),
+            disabled=payload.get("disabled"),
+        )
 
-    return serch_user(username)
+    return await serch_user(username)
 
 
 async def current_user(user: User = Depends(auth_user)):
@@ -38,4 +136,11 @@ async def current_user(user: User = Depends(auth_user)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user"
         )
-    return user
\ No newline at end of file
+    return user
+
+
+async def stream_user(
+    token: str = Query(..., description="Stream token from POST /dash/stream-token (EventSource cannot send headers)")
+):
+    payload = decode_token(token, STREAM_TOKEN_SCOPE)
+    return await current_user(await serch_user(payload["sub"]))
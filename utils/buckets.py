@@ -0,0 +1,131 @@
+import math
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+load_dotenv()
+
+# Series de tiempo del dashboard: un rango [start, end) en hora local de
+# `timezone`, agrupado por granularidad con $dateTrunc y con los huecos
+# rellenados en la base de datos con $densify. Las fechas se guardan como UTC
+# sin zona horaria.
+GRANULARITIES = ("hour", "day", "week", "month", "year")
+DEFAULT_TIMEZONE = os.getenv("DASH_TIMEZONE", "UTC")
+MAX_BUCKETS = int(os.getenv("DASH_MAX_BUCKETS", "2000"))
+
+UTC = ZoneInfo("UTC")
+
+_APPROXIMATE_SECONDS = {
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+    "month": 28 * 24 * 60 * 60,
+    "year": 365 * 24 * 60 * 60,
+}
+
+
+def get_timezone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+def bucket_start(date: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return date.replace(minute=0, second=0, microsecond=0)
+    day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        # Igual que $dateTrunc con startOfWeek "monday"
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_bucket(date: datetime, granularity: str) -> datetime:
+    start = bucket_start(date, granularity)
+    if granularity == "hour":
+        return start + timedelta(hours=1)
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(weeks=1)
+    if granularity == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def bucket_count(start: datetime, end: datetime, granularity: str) -> int:
+    # Cota superior: sirve para rechazar rangos con demasiados puntos
+    return math.ceil((end - start).total_seconds() / _APPROXIMATE_SECONDS[granularity]) + 1
+
+
+def to_utc(local: datetime, timezone: str) -> datetime:
+    # Cerca de datetime.min o datetime.max el cambio de zona se sale del rango
+    try:
+        return local.replace(tzinfo=get_timezone(timezone)).astimezone(UTC).replace(tzinfo=None)
+    except OverflowError:
+        raise ValueError("Date out of range")
+
+
+def range_predicate(start: datetime | None, end: datetime, timezone: str) -> dict:
+    # Siempre un rango explicito sobre el campo de fecha, para poder usar los indices
+    predicate = {"$lt": to_utc(end, timezone)}
+    if start is not None:
+        predicate["$gte"] = to_utc(start, timezone)
+    return predicate
+
+
+def local_time_expression(date_path: str, timezone: str):
+    # Hora local expresada como fecha UTC: los buckets y $densify trabajan sobre
+    # la hora "de reloj", asi los cambios de horario no desalinean la serie
+    if timezone == "UTC":
+        return date_path
+    return {
+        "$let": {
+            "vars": {"parts": {"$dateToParts": {"date": date_path, "timezone": timezone}}},
+            "in": {
+                "$dateFromParts": {
+                    "year": "$$parts.year",
+                    "month": "$$parts.month",
+                    "day": "$$parts.day",
+                    "hour": "$$parts.hour",
+                }
+            },
+        }
+    }
+
+
+def bucket_expression(date_path: str, granularity: str, timezone: str) -> dict:
+    truncate = {"date": local_time_expression(date_path, timezone), "unit": granularity}
+    if granularity == "week":
+        truncate["startOfWeek"] = "monday"
+    return {"$dateTrunc": truncate}
+
+
+def series_stages(
+    date_path: str,
+    count,
+    start: datetime | None,
+    end: datetime,
+    granularity: str,
+    timezone: str,
+) -> list[dict]:
+    # Sin inicio (por ejemplo 'all years') la serie va del primer al ultimo bucket con datos
+    bounds = "full" if start is None else [bucket_start(start, granularity), end]
+    return [
+        {
+            "$group": {
+                "_id": bucket_expression(date_path, granularity, timezone),
+                "total_count": {"$sum": count},
+            }
+        },
+        {"$project": {"_id": 0, "period": "$_id", "total_count": 1}},
+        {"$densify": {"field": "period", "range": {"step": 1, "unit": granularity, "bounds": bounds}}},
+        {"$set": {"total_count": {"$ifNull": ["$total_count", 0]}}},
+        {"$sort": {"period": 1}},
+    ]
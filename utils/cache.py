@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Cache LRU acotada con expiracion por entrada. Cada worker corre en un solo
+    # event loop, asi que no hace falta bloquear.
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,12 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+
+
+class CompressionMiddleware(GZipMiddleware):
+    # GZip para las respuestas grandes, salvo Server-Sent Events: gzip retendria
+    # los eventos en su buffer hasta juntar suficientes bytes
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "text/event-stream" in Headers(scope=scope).get("accept", ""):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
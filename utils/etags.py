@@ -0,0 +1,26 @@
+import hashlib
+from fastapi import Request, Response, status
+
+
+def weak_etag(version: str, *scope) -> str:
+    # La misma version da ETags distintos por usuario (rol y zona) y por parametros
+    digest = hashlib.blake2b(repr((version, scope)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_headers(etag: str) -> dict:
+    # private, no-cache: el navegador guarda la respuesta pero siempre revalida
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Comparacion debil: se ignora el prefijo W/
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+
+from db.client import db_client
+from db.rollups import rollup_deltas, rollup_filter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+# Con un replica set, los cambios de reports llegan por change stream y se ven
+# en todos los workers; sin el, cada worker publica sus propias escrituras
+DASH_CHANGE_STREAMS = os.getenv("DASH_CHANGE_STREAMS", "false").lower() == "true"
+
+
+class EventBus:
+    # Cada suscriptor tiene su cola acotada: si un cliente lento se atrasa se
+    # descarta su evento mas viejo en lugar de frenar a quien publica
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.change_stream_active = False
+        self._subscribers: set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+report_events = EventBus(EVENT_QUEUE_SIZE)
+
+
+def dashboard_event(deltas: dict[tuple, int]) -> dict:
+    # Cambios en los conteos por bucket y en el total por estado (buckets de creation_date)
+    statuses = Counter()
+    for key, delta in deltas.items():
+        bucket = rollup_filter(key)
+        if bucket["date_field"] == "creation_date":
+            statuses[bucket["delivery_status"]] += delta
+
+    return {
+        "counts": [{**rollup_filter(key), "delta": delta} for key, delta in deltas.items()],
+        "statuses": dict(statuses),
+    }
+
+
+def merge_events(events: list[dict]) -> dict:
+    merged = {"counts": [], "statuses": Counter(), "refresh": False}
+    for event in events:
+        merged["counts"].extend(event.get("counts", []))
+        merged["statuses"].update(event.get("statuses", {}))
+        merged["refresh"] = merged["refresh"] or event.get("refresh", False)
+    merged["statuses"] = {status: delta for status, delta in merged["statuses"].items() if delta}
+    return merged
+
+
+def publish_report_deltas(deltas: dict[tuple, int]):
+    # Si el change stream esta activo, el evento llegara por ahi
+    if deltas and not report_events.change_stream_active:
+        report_events.publish(dashboard_event(deltas))
+
+
+async def watch_report_changes():
+    try:
+        stream = await db_client.reports.watch(
+            full_document="updateLookup", full_document_before_change="whenAvailable"
+        )
+    except PyMongoError as e:
+        logger.warning("Change streams unavailable, publishing local writes only: %s", e)
+        return
+
+    report_events.change_stream_active = True
+    try:
+        async with stream:
+            async for change in stream:
+                operation = change["operationType"]
+                if operation == "delete":
+                    # Solo el archivo borra reportes y los rollups no cambian
+                    continue
+                before = change.get("fullDocumentBeforeChange")
+                after = change.get("fullDocument")
+                if operation == "insert":
+                    deltas = rollup_deltas([(None, after)])
+                elif operation in ("update", "replace") and before is not None and after is not None:
+                    deltas = rollup_deltas([(before, after)])
+                else:
+                    # Sin pre-imagen no se puede calcular el delta: el cliente recarga
+                    report_events.publish({"refresh": True})
+                    continue
+                if deltas:
+                    report_events.publish(dashboard_event(deltas))
+    except PyMongoError as e:
+        logger.error("Report change stream stopped: %s", e)
+    finally:
+        report_events.change_stream_active = False
@@ -0,0 +1,97 @@
+import asyncio
+import csv
+import io
+import tempfile
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+try:
+    import openpyxl
+except ImportError:  # XLSX es opcional: pip install openpyxl
+    openpyxl = None
+
+EXPORT_BATCH_SIZE = 1000
+XLSX_CHUNK_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = [
+    "id",
+    "creation_date",
+    "delivery_date",
+    "airline",
+    "reference_number",
+    "bdo_number",
+    "destination",
+    "delivery_zone",
+    "operator_id",
+    "operator_name",
+    "delivery_status",
+]
+
+
+def export_row(report: dict) -> list:
+    operator = report.get("operator") or {}
+    return [
+        str(report["_id"]),
+        report.get("creation_date"),
+        report.get("delivery_date"),
+        report.get("airline"),
+        report.get("reference_number"),
+        report.get("bdo_number"),
+        report.get("destination"),
+        report.get("delivery_zone"),
+        operator.get("operator_id"),
+        operator.get("operator_name"),
+        report.get("delivery_status"),
+    ]
+
+
+def csv_response(cursor, headers: dict) -> StreamingResponse:
+    # Se escribe un lote de filas a la vez: la memoria no depende del total exportado
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        count = 0
+        async for report in cursor:
+            writer.writerow(export_row(report))
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(rows(), media_type="text/csv", headers=headers)
+
+
+async def xlsx_response(cursor, headers: dict) -> StreamingResponse:
+    if openpyxl is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="XLSX export is not available, install openpyxl",
+        )
+
+    # En modo write_only openpyxl va volcando las filas a disco; el archivo
+    # terminado se envia por partes desde un temporal
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("reports")
+    sheet.append(EXPORT_COLUMNS)
+    async for report in cursor:
+        sheet.append(export_row(report))
+
+    output = tempfile.TemporaryFile()
+    await asyncio.to_thread(workbook.save, output)
+    output.seek(0)
+
+    async def chunks():
+        try:
+            while chunk := await asyncio.to_thread(output.read, XLSX_CHUNK_SIZE):
+                yield chunk
+        finally:
+            output.close()
+
+    return StreamingResponse(
+        chunks(),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers,
+    )
@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Query, status
+
+from models.dash import ReportFilters
+from models.report import DeliveryStatus
+from utils.buckets import DEFAULT_TIMEZONE, GRANULARITIES, MAX_BUCKETS, bucket_count, bucket_start, get_timezone, next_bucket, range_predicate
+
+# Granularidad por defecto de cada filtro
+FILTER_GRANULARITIES = {
+    "15 days": "day",
+    "weekly": "day",
+    "monthly": "day",
+    "year": "month",
+    "all years": "year",
+    "custom": "day",
+}
+
+
+async def report_filters(
+    filter: str = Query(
+        ...,
+        description="Filter reports by '15 days', 'weekly', 'monthly', 'year', 'all years' or 'custom'",
+    ),
+    month: int = Query(None, ge=1, le=12, description="Specify the month for 'monthly' filter"),
+    # Hasta 9998: el fin del rango es el año siguiente
+    year: int = Query(None, ge=1, le=9998, description="Specify the year for 'year' filter"),
+    operator_id: str = Query(
+        None, description="Specify the operator ID to filter reports by operator"
+    ),
+    airline: str = Query(
+        None, description="Specify the airline to filter reports by airline"
+    ),
+    delivery_status: str = Query(
+        None, description="Specify the status to filter reports by status"
+    ),
+    start: datetime = Query(
+        None, description="Start of the 'custom' range (inclusive)"
+    ),
+    end: datetime = Query(None, description="End of the 'custom' range (exclusive)"),
+    granularity: str = Query(
+        None,
+        description="Bucket size: 'hour', 'day', 'week', 'month' or 'year' (depends on the filter if omitted)",
+    ),
+    timezone: str = Query(
+        DEFAULT_TIMEZONE, description="IANA timezone for the range and the buckets"
+    ),
+) -> ReportFilters:
+    # Filtros compartidos por los conteos de /dash/ y el detalle paginado
+    match_conditions = {}
+
+    if delivery_status:
+        match_conditions["delivery_status"] = delivery_status
+    else:
+        match_conditions["delivery_status"] = {
+            "$in": [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]
+        }
+
+    if operator_id:
+        match_conditions["operator.operator_id"] = operator_id
+
+    if airline and airline != "Todas":
+        match_conditions["airline"] = airline
+
+    if delivery_status in [DeliveryStatus.completed.value, DeliveryStatus.invoiced.value]:
+        date_field = "delivery_date"
+    else:
+        date_field = "creation_date"
+
+    if filter not in FILTER_GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid filter value"
+        )
+
+    granularity = granularity or FILTER_GRANULARITIES[filter]
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid granularity value"
+        )
+    # 'all years' no tiene inicio: no se puede acotar la cantidad de buckets de
+    # antemano, asi que solo se agrupa por año
+    if filter == "all years" and granularity != "year":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The 'all years' filter only supports 'year' granularity",
+        )
+
+    try:
+        zone = get_timezone(timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # Todas las ventanas son [start_date, end_date) en hora local de la zona pedida
+    today = bucket_start(datetime.now(zone).replace(tzinfo=None), "day")
+
+    if filter == "15 days":
+        start_date = today - timedelta(days=15)
+        end_date = today + timedelta(days=1)
+    elif filter == "weekly":
+        start_date = bucket_start(today, "week")
+        end_date = next_bucket(start_date, "week")
+    elif filter == "monthly":
+        if month is not None and year is not None:
+            start_date = datetime(year, month, 1)
+        else:
+            start_date = bucket_start(today, "month")
+        end_date = next_bucket(start_date, "month")
+    elif filter == "year":
+        start_date = datetime(year if year is not None else today.year, 1, 1)
+        end_date = next_bucket(start_date, "year")
+    elif filter == "all years":
+        # Sin inicio, pero con fin explicito; se agrupa por creation_date, como antes
+        start_date = None
+        end_date = next_bucket(today, "year")
+        date_field = "creation_date"
+    else:
+        if start is None or end is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The 'custom' filter requires start and end",
+            )
+        # Fechas con zona horaria se pasan a la hora local de la zona pedida
+        try:
+            start_date, end_date = [
+                date.astimezone(zone).replace(tzinfo=None) if date.tzinfo else date
+                for date in (start, end)
+            ]
+        except OverflowError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Date out of range"
+            )
+        if start_date >= end_date:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="start must be before end",
+            )
+
+    if start_date is not None and bucket_count(start_date, end_date, granularity) > MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The range cannot have more than {MAX_BUCKETS} buckets",
+        )
+
+    try:
+        match_conditions[date_field] = range_predicate(start_date, end_date, timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return ReportFilters(
+        filter=filter,
+        match_conditions=match_conditions,
+        date_field=date_field,
+        start=start_date,
+        end=end_date,
+        granularity=granularity,
+        timezone=timezone,
+    )
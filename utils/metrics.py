@@ -0,0 +1,250 @@
+import time
+from pymongo import monitoring
+
+# Metricas en formato de texto de Prometheus. Cada worker agrega en memoria sin
+# locks: las peticiones y los eventos del cliente async de Mongo corren en el
+# mismo event loop. Prometheus suma los workers al hacer scrape de cada uno.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, *labels, value: float):
+        # Para copiar contadores que ya lleva otro componente (por ejemplo las caches)
+        self._values[labels] = value
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [conteo por bucket (no acumulado), suma, total]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total_sum, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total_sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being processed")
+
+mongo_commands = Counter(
+    "mongo_commands_total", "MongoDB commands by collection, command and outcome", ("collection", "command", "outcome")
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection and command", ("collection", "command")
+)
+
+mongo_pool_connections = Gauge("mongo_pool_connections", "Open MongoDB connections by server", ("address",))
+mongo_pool_checked_out = Gauge(
+    "mongo_pool_checked_out", "MongoDB connections in use by server", ("address",)
+)
+mongo_pool_waiting = Gauge(
+    "mongo_pool_waiting", "Operations waiting for a MongoDB connection by server", ("address",)
+)
+mongo_pool_checkout_failures = Counter(
+    "mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ("address", "reason")
+)
+
+METRICS = [
+    http_requests,
+    http_request_duration,
+    http_in_flight,
+    mongo_commands,
+    mongo_command_duration,
+    mongo_pool_connections,
+    mongo_pool_checked_out,
+    mongo_pool_waiting,
+    mongo_pool_checkout_failures,
+]
+
+# Funciones que devuelven lineas extra al momento del scrape (caches, pools...)
+collectors = []
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # Middleware ASGI puro: no envuelve el cuerpo de la respuesta, asi que
+    # tambien sirve para las respuestas en streaming
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            # FastAPI deja la ruta encontrada en el scope: se usa su plantilla, no la URL
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route_path)
+            http_requests.inc(scope["method"], route_path, str(status_code))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        # El primer campo del comando es su nombre y normalmente trae la coleccion
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = event.database_name
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _record(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "unknown")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+        mongo_commands.inc(collection, event.command_name, outcome)
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    # Estado del pool por servidor a partir de los eventos CMAP del driver
+    def __init__(self):
+        self._addresses = set()
+
+    def _address(self, event) -> str:
+        address = "%s:%s" % event.address
+        self._addresses.add(address)
+        return address
+
+    def stats(self) -> dict:
+        return {
+            address: {
+                "connections": mongo_pool_connections.get(address),
+                "checked_out": mongo_pool_checked_out.get(address),
+                "waiting": mongo_pool_waiting.get(address),
+            }
+            for address in sorted(self._addresses)
+        }
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(self._address(event))
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec(self._address(event))
+
+    def connection_check_out_started(self, event):
+        mongo_pool_waiting.inc(self._address(event))
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        mongo_pool_waiting.dec(address)
+        mongo_pool_checked_out.inc(address)
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        mongo_pool_waiting.dec(address)
+        mongo_pool_checkout_failures.inc(address, str(event.reason))
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.dec(self._address(event))
+
+    def pool_created(self, event):
+        self._address(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
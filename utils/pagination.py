@@ -0,0 +1,96 @@
+import heapq
+import orjson
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+MAX_PAGE_SIZE = 500
+
+
+def keyset_filter(query: dict, after: str | None) -> dict:
+    # Paginacion por _id: el cursor es el id del ultimo documento de la pagina anterior
+    if after is None:
+        return query
+    try:
+        after_id = ObjectId(after)
+    except (InvalidId, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor"
+        )
+    return {**query, "_id": {"$gt": after_id}}
+
+
+def encode_date_cursor(date: datetime, document_id: ObjectId) -> str:
+    return f"{date.isoformat()}_{document_id}"
+
+
+def date_keyset_filter(query: dict, date_field: str, after: str | None) -> dict:
+    # Paginacion ordenada por (fecha, _id): el _id desempata reportes con la misma fecha
+    if after is None:
+        return query
+    try:
+        after_date, after_id = after.rsplit("_", 1)
+        after_date = datetime.fromisoformat(after_date)
+        after_id = ObjectId(after_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor"
+        )
+    return {
+        "$and": [
+            query,
+            {
+                "$or": [
+                    {date_field: {"$gt": after_date}},
+                    {date_field: after_date, "_id": {"$gt": after_id}},
+                ]
+            },
+        ]
+    }
+
+
+async def paginate(
+    collection, query: dict, schema, limit: int, after: str | None = None, projection: dict | None = None
+) -> dict:
+    # Se pide un documento extra para saber si existe una pagina siguiente
+    cursor = collection.find(keyset_filter(query, after), projection).sort("_id", 1).limit(limit + 1)
+    items = [schema(document) async for document in cursor]
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1]["id"]
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def merge_sorted(cursors: list, key):
+    # Mezcla cursores ya ordenados por key en un solo flujo ordenado (por ejemplo
+    # reports y reports_archive), leyendo un documento por cursor a la vez
+    iterators = [cursor.__aiter__() for cursor in cursors]
+    heap = []
+    for index, iterator in enumerate(iterators):
+        document = await anext(iterator, None)
+        if document is not None:
+            heap.append((key(document), index, document))
+    heapq.heapify(heap)
+
+    while heap:
+        _, index, document = heap[0]
+        yield document
+        following = await anext(iterators[index], None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (key(following), index, following))
+
+
+def stream_ndjson(cursor, schema) -> StreamingResponse:
+    # Cada documento se escribe en cuanto el cursor lo entrega, sin acumular la coleccion
+    async def lines():
+        async for document in cursor:
+            yield orjson.dumps(schema(document)) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
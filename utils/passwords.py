@@ -0,0 +1,46 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+load_dotenv()
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+crypt = CryptContext(schemes=["bcrypt"])
+
+
+class PasswordHasher:
+    # bcrypt tarda cientos de ms y libera el GIL: se ejecuta en un pool de hilos
+    # propio para no congelar el event loop. Los contadores solo se tocan desde
+    # el event loop.
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queued = 0
+        self.active = 0
+        self._semaphore = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, func, *args):
+        self.queued += 1
+        async with self._semaphore:
+            self.queued -= 1
+            self.active += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, func, *args)
+            finally:
+                self.active -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(crypt.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(crypt.verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "active": self.active, "queued": self.queued}
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS)
@@ -0,0 +1,79 @@
+import os
+import time
+import orjson
+from dotenv import load_dotenv
+from fastapi import Request, Response
+
+from db.client import analytics_db, db_client, mongo_settings
+from utils.cache import TTLCache
+from utils.singleflight import SingleFlight
+
+load_dotenv()
+
+DASH_CACHE_SIZE = int(os.getenv("DASH_CACHE_SIZE", "256"))
+DASH_CACHE_MAX_STALENESS = float(os.getenv("DASH_CACHE_MAX_STALENESS", "300"))
+
+
+class ResponseCache(TTLCache):
+    # Respuestas JSON ya serializadas, por ruta y parametros normalizados.
+    # La version de escritura forma parte de la clave: al subirla, las entradas
+    # anteriores dejan de encontrarse y salen por LRU. Una consulta que empezo
+    # antes de una escritura guarda su resultado con la version vieja, asi que
+    # nunca se sirve despues. La version es local al worker; max staleness
+    # acota lo que puede tardar en verse una escritura hecha en otro worker.
+    # Las consultas leen de `database`, que puede ir hasta settle_seconds
+    # atrasada: en esa ventana despues de un bump el relleno lee de
+    # `fresh_database` (el primario), que ya incluye la escritura.
+    def __init__(self, maxsize: int, ttl: float, database, fresh_database, settle_seconds: float = 0):
+        super().__init__(maxsize, ttl)
+        self.version = 0
+        self.database = database
+        self.fresh_database = fresh_database
+        self.settle_seconds = settle_seconds
+        self.bumped_at = float("-inf")
+        self.fresh_refills = 0
+        self.flights = SingleFlight()
+
+    def bump(self):
+        self.version += 1
+        self.bumped_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "fresh_refills": self.fresh_refills}
+
+    def lookup(self, request: Request) -> tuple[tuple, Response | None]:
+        params = tuple(sorted(request.query_params.multi_items()))
+        key = (self.version, request.url.path, params)
+        body = self.get(key)
+        if body is None:
+            return key, None
+        return key, Response(body, media_type="application/json")
+
+    async def fetch(self, request: Request, scope: tuple, compute) -> Response:
+        # compute(database) devuelve el contenido de la respuesta. Si falta en la cache,
+        # las peticiones iguales que llegan mientras se calcula esperan esa misma
+        # consulta; la version en la clave evita unirse a una anterior a una escritura.
+        key, cached = self.lookup(request)
+        if cached is not None:
+            return cached
+
+        async def compute_body() -> bytes:
+            database = self.database
+            if time.monotonic() - self.bumped_at < self.settle_seconds:
+                database = self.fresh_database
+                self.fresh_refills += 1
+            body = orjson.dumps(await compute(database))
+            self.set(key, body)
+            return body
+
+        body = await self.flights.run((key, scope), compute_body)
+        return Response(body, media_type="application/json")
+
+
+dash_cache = ResponseCache(
+    maxsize=DASH_CACHE_SIZE,
+    ttl=DASH_CACHE_MAX_STALENESS,
+    database=analytics_db,
+    fresh_database=db_client,
+    settle_seconds=mongo_settings.analytics_lag_seconds(),
+)
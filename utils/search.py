@@ -1,28 +1,45 @@
+import os
+from dotenv import load_dotenv
 from fastapi import HTTPException, status
 from db.client import db_client
-from models.user import User, UserDB
+from db.schema.user_schema import USER_PROJECTION
+from models.user import User, UserRecord
+from utils.cache import TTLCache
 
-def serch_user_db(username: str):
+load_dotenv()
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Usuarios autenticados ya resueltos, por username
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def serch_user_db(username: str):
     # Buscar en MongoDB
-    user_data = db_client.users.find_one({"username": username})
+    user_data = await db_client.users.find_one({"username": username})
     if user_data is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     # Convertir el diccionario user_data en una instancia del modelo User
     user_data["id"] = str(user_data["_id"])  # Asegurarse de que el campo id esté presente y sea un string
-    user = UserDB(**user_data)
+    user = UserRecord(**user_data)
     
     return user
 
 
 
-def serch_user(username: str):
-    # Buscar el usuario en la base de datos
-    user_data = db_client.users.find_one({"username": username})
+async def serch_user(username: str):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    # Buscar el usuario en la base de datos (sin la contraseña)
+    user_data = await db_client.users.find_one({"username": username}, USER_PROJECTION)
     if user_data is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
     # Convertir el diccionario user_data en una instancia del modelo User
     user_data["id"] = str(user_data["_id"])  # Asegurarse de que el campo id esté presente y sea un string
     user = User(**user_data)
+    user_cache.set(username, user)
 
     return user
@@ -0,0 +1,37 @@
+import asyncio
+
+
+class SingleFlight:
+    # Peticiones concurrentes con la misma clave comparten una sola ejecucion:
+    # la primera la inicia y las demas esperan su resultado (o su excepcion).
+    # Nada se guarda despues de terminar, asi que no agrega atraso.
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict = {}
+
+    async def run(self, key, func):
+        task = self._flights.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+
+        # shield: si un cliente se desconecta, la consulta sigue para los demas
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Future):
+        self._flights.pop(key, None)
+        # Si todos los que esperaban se cancelaron, la excepcion se marca como leida
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+        }